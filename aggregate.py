@@ -0,0 +1,210 @@
+"""
+This file contains the aggregation of the pollution maps of many runs that are
+simulated in parallel. Every worker process adds the grids of its runs to a
+sum and a sum of squares per cell and type of pollution, which are kept in
+shared memory. No grids are sent between the processes: when all runs are
+done, the mean and variance of every cell are computed in place in the shared
+memory and drawn from there.
+"""
+
+import sys
+from multiprocessing import Lock, Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import matplotlib
+
+# Only save the figures, this also makes plotting work without a screen.
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from pollution import spread_map
+
+POL_TYPES = ["CO2", "NO", "HC", "CO"]
+
+# The shared sums of the worker process, set by init_worker.
+shared = None
+lock = None
+
+
+class SharedGrids:
+    """
+    The sums and sums of squares of the pollution grids of every type, as an
+    array of shape (2, types, width, height) in shared memory.
+    """
+
+    def __init__(self, shape, name=None) -> None:
+        """Make the shared memory, or attach to it if a name is given."""
+        size = int(np.prod(shape)) * np.dtype(float).itemsize
+        if name is None:
+            self.shm = SharedMemory(create=True, size=size)
+        else:
+            self.shm = SharedMemory(name=name)
+        self.shape = shape
+        self.array = np.ndarray(shape, dtype=float, buffer=self.shm.buf)
+        if name is None:
+            self.array[:] = 0
+
+    def add(self, i, grid):
+        """Add the grid of the type with index i to the sums."""
+        self.array[0, i] += grid
+        self.array[1, i] += grid**2
+
+    def to_moments(self, n):
+        """
+        Turn the sums of n runs into the mean and the (sample) variance of
+        every cell, in place.
+        """
+        mean, var = self.array[0], self.array[1]
+        mean /= n
+        var -= n * mean**2
+        var /= max(n - 1, 1)
+        np.maximum(var, 0, out=var)
+        return mean, var
+
+    def close(self, unlink=False):
+        """Detach from the shared memory, and free it if unlink is True."""
+        del self.array
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def init_worker(name, shape, worker_lock):
+    """Attach a worker process to the shared sums."""
+    global shared, lock
+    shared = SharedGrids(shape, name)
+    lock = worker_lock
+
+
+def run(args):
+    """
+    Simulate a single run and add its pollution grids to the shared sums.
+    Returns the total pollution of every type.
+    """
+    seed, secs, bounds, settings = args
+    cell_size, spread, light_duration, car_gen_prob = settings
+
+    from simulation import Simulation
+
+    sim = Simulation(cell_size=cell_size)
+    sim.set_streams(seed)
+    sim.light_duration = light_duration
+    sim.car_gen_prob = car_gen_prob
+    for _ in range(int(secs * sim.FPS)):
+        sim.simulate()
+    sim.flush_pollution()
+
+    cells = int(np.ceil(spread / cell_size))
+    grids = []
+    for pol_map in sim.pol_maps:
+        grid, _ = pol_map.rasterise().to_array(bounds)
+        grids.append(spread_map(grid, cells) if cells > 0 else grid)
+
+    with lock:
+        for i, grid in enumerate(grids):
+            shared.add(i, grid)
+    return [pol_map.total_pol for pol_map in sim.pol_maps]
+
+
+def save_image(mean, var, origin, cell_size, output):
+    """Plot the mean and the standard deviation of every type of pollution."""
+    width, height = np.array(mean.shape[1:]) * cell_size
+    extent = (origin[0], origin[0] + width, origin[1] + height, origin[1])
+
+    _, axs = plt.subplots(2, len(POL_TYPES), figsize=(4 * len(POL_TYPES), 8))
+    for i, pol_type in enumerate(POL_TYPES):
+        rows = [(axs[0, i], mean[i], "mean"), (axs[1, i], np.sqrt(var[i]), "std")]
+        for ax, grid, name in rows:
+            ax.imshow(
+                (grid / max(grid.max(), 1e-12)).T,
+                interpolation="none",
+                cmap="hot",
+                vmin=0,
+                extent=extent,
+            )
+            ax.set_title(f"{pol_type} pollution ({name})")
+            ax.axis("off")
+    plt.savefig(output + ".png")
+    plt.close()
+
+
+def aggregate(
+    runs,
+    secs,
+    output,
+    cell_size=5,
+    spread=15,
+    light_duration=10,
+    car_gen_prob=10 / 9,
+    processes=None,
+):
+    """
+    Simulate a number of runs with seeds 0 to runs - 1 in a pool of
+    processes, and write the mean and variance of the pollution of every
+    cell to output.npz and output.png. Returns the totals of every run.
+    """
+    from simulation import Simulation
+
+    # The grids cover the world and the pollution spread around it.
+    world = Simulation(cell_size=cell_size).world
+    bounds = (
+        world[0] - spread,
+        world[1] - spread,
+        world[2] + spread,
+        world[3] + spread,
+    )
+    x0 = int(np.floor(bounds[0] / cell_size))
+    y0 = int(np.floor(bounds[1] / cell_size))
+    shape = (
+        2,
+        len(POL_TYPES),
+        max(int(np.ceil(bounds[2] / cell_size)), x0 + 1) - x0,
+        max(int(np.ceil(bounds[3] / cell_size)), y0 + 1) - y0,
+    )
+    origin = (x0 * cell_size, y0 * cell_size)
+
+    sums = SharedGrids(shape)
+    try:
+        settings = (cell_size, spread, light_duration, car_gen_prob)
+        with Pool(
+            processes, init_worker, (sums.shm.name, shape, Lock())
+        ) as pool:
+            totals = pool.map(
+                run, [(seed, secs, bounds, settings) for seed in range(runs)]
+            )
+            # Let the workers stop by themselves, pygame catches the signal
+            # that terminates them.
+            pool.close()
+            pool.join()
+
+        mean, var = sums.to_moments(runs)
+        np.savez(
+            output,
+            origin=origin,
+            cell_size=cell_size,
+            **{f"{t}_mean": mean[i] for i, t in enumerate(POL_TYPES)},
+            **{f"{t}_var": var[i] for i, t in enumerate(POL_TYPES)},
+        )
+        save_image(mean, var, origin, cell_size, output)
+        del mean, var
+    finally:
+        sums.close(unlink=True)
+    return totals
+
+
+def main():
+    # The number of runs, the number of seconds per run and the output.
+    runs = int(sys.argv[1])
+    secs = int(sys.argv[2])
+    output = sys.argv[3]
+    processes = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    totals = np.array(aggregate(runs, secs, output, processes=processes))
+    for pol_type, mean, std in zip(POL_TYPES, totals.mean(0), totals.std(0)):
+        print(f"{pol_type}: {mean:.1f} +- {std:.1f} mg")
+
+
+if __name__ == "__main__":
+    main()
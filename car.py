@@ -4,7 +4,6 @@ method to move the car on a Road, to change Roads at the end of the road and
 to update the speed based on other veichles.
 """
 
-from math import dist
 import numpy as np
 from dataclasses import dataclass
 
@@ -23,10 +22,31 @@ CAR_CO = EmmissionType(1.5, 23, 5.5, 11)
 CAR_CO2 = EmmissionType(1.7, 6.4, 2.6, 4.1)
 EM_TYPES = {"NO": CAR_NO, "HC": CAR_HC, "CO": CAR_CO, "CO2": CAR_CO2}
 
+# A car closer than this to the car or the red light in front of it stops.
+STOP_DIST = 45
+
+
+def driving_state(v, a):
+    """
+    Get the driving state of a car with speed v and acceleration a. The state
+    is the name of the matching field of EmmissionType.
+    """
+    if v < 10:
+        # We consider speeds less than 10 units/second as idle
+        return "idle"
+
+    if a > 0.1:
+        return "accel"
+
+    if a < 0.1:
+        return "decel"
+    return "cruise"
+
 
 class Car:
-    def __init__(self, max_speed, path, color):
+    def __init__(self, max_speed, path, color, car_id=0):
         """Set the start parameters"""
+        self.id = car_id
         self.max = max_speed
         self.v = max_speed
         self.a = 0
@@ -38,57 +58,107 @@ class Car:
         # A meter is 4 pixels, so times 4.
         self.max_a = 0.73 * 4
         self.max_brake = 1.67 * 4
+        # Used for the desired distance to the car in front.
+        self.brake_term = 2 * np.sqrt(self.max_a * self.max_brake)
 
         # Variables for the path of the car.
         self.path = path
         self.index = 0
         self.road = self.path[0]
 
-        # Variables for the position and orientation.
-        self.pos = [self.road.start[0], self.road.start[1]]
-        self.dir = self.road.angle
+        # How far the car is along the current road. The position and
+        # orientation of the car follow from it when they are needed.
+        self.s = 0
+
+        # The driving state of the car since frame em_since, and where it was
+        # then. Its pollution is only added when the state changes.
+        self.em_state = None
+        self.em_where = None
+        self.em_road = self.road
+        self.em_distance = 0
+        self.em_since = 0
+
+        # The router to take the fastest way at junctions, if any.
+        self.router = None
+        # The collector of the KPIs of the car, if any.
+        self.kpi = None
 
-        # How far the car is on the current road.
-        self.progress = 0
+        # A dormant car is stopped and is not updated until it is woken.
+        self.dormant = False
 
-        # Which car is in front
-        self.in_front = self.check_in_front()
+        # Which car is in front, found every step by change_speed.
+        self.in_front = None
 
         # Add the car to the list of cars on that road.
         self.road.cars.append(self)
 
+    def state(self, road_index):
+        """
+        Get the state of the car as a tuple, so it can be sent to another
+        process. Roads are replaced by their index in road_index.
+        """
+        return (
+            self.id,
+            tuple(road_index[id(road)] for road in self.path),
+            self.index,
+            self.s,
+            self.v,
+            self.a,
+            self.max,
+            self.color,
+        )
+
+    @classmethod
+    def from_state(cls, state, roads):
+        """
+        Make a car from a state made with Car.state and add it to the road
+        it is on. Roads is the list of roads the indices refer to.
+        """
+        car_id, path, index, s, v, a, max_speed, color = state
+        car = cls(max_speed, [roads[i] for i in path], color, car_id)
+
+        # Move the car from the start of its path to the road it is on.
+        car.road.cars.pop()
+        car.index = index
+        car.road = car.path[index]
+        car.s = s
+        car.v = v
+        car.a = a
+        car.road.cars.append(car)
+        return car
+
+    @property
+    def progress(self):
+        """How far the car is along the current road, as a fraction."""
+        return self.s / self.road.length
+
+    @property
+    def pos(self):
+        """The position of the car in the world."""
+        return [
+            self.road.start[0] + self.road.unit[0] * self.s,
+            self.road.start[1] + self.road.unit[1] * self.s,
+        ]
+
+    @property
+    def dir(self):
+        """The orientation of the car, which is the angle of its road."""
+        return self.road.angle
+
     def cur_pollution(self, pol_type="CO2"):
         """
         These valeus are for CO emissions. The values are in mg/sec, and based
         on the paper "On Road Measurements of Vehicle Tailpipe Emissions" by
         Frey et al.
         """
-        if self.v < 10:
-            # We consider speeds less than 10 units/second as idle
-            return EM_TYPES[pol_type].idle
-
-        if self.a > 0.1:
-            return EM_TYPES[pol_type].accel
-
-        if self.a < 0.1:
-            return EM_TYPES[pol_type].decel
-        return EM_TYPES[pol_type].cruise
-
-    def gen_pollution(self, dt, pol_type="CO2"):
-        """Add pollution to the road the car is on."""
-        return self.pos[0], self.pos[1], self.cur_pollution(pol_type) * dt
+        return getattr(EM_TYPES[pol_type], driving_state(self.v, self.a))
 
     def move(self, dt):
-        """Move the car according to the timestep and its speed."""
-        # In pygame, y is going down, so we have to invert it.
-        self.pos[0] += np.cos(self.dir) * self.v * dt
-        self.pos[1] += -np.sin(self.dir) * self.v * dt
-
-        # How far the car is along the road.
-        self.progress = dist(self.pos, self.road.start) / self.road.length
+        """Move the car along its road according to the timestep and speed."""
+        self.s += self.v * dt
 
         # If the car is at the end of the road, change the road.
-        if self.progress > 1:
+        if self.s > self.road.length:
             return self.change_road()
 
         return False
@@ -99,17 +169,27 @@ class Car:
         the current road has ended. Return True if this can be done, otherwise
         return False.
         """
-        # Remove the car from the current road
+        # Remove the car from the current road. The distance it drove past
+        # the end is driven on the next road.
         self.road.cars.remove(self)
+        overshoot = max(self.s - self.road.length, 0)
+        if self.kpi:
+            self.kpi.change_road(self, self.road)
 
         self.index += 1
         if self.index >= len(self.path):
             return True
 
+        # Take the fastest way from this junction to the end of the path.
+        if self.router:
+            route = self.router.route(self.road, self.path[-1])
+            if route and route != self.path[self.index - 1 :]:
+                self.path = self.path[: self.index] + route[1:]
+                if self.kpi:
+                    self.kpi.change_path(self)
+
         self.road = self.path[self.index]
-        self.pos = [self.road.start[0], self.road.start[1]]
-        self.progress = 0
-        self.dir = self.road.angle
+        self.s = overshoot
 
         # Add the car to the new road
         self.road.cars.append(self)
@@ -129,7 +209,7 @@ class Car:
                 self.decelerate(self.in_front.v, distance)
             # Wait if necessary.
             elif self.wait(in_roads):
-                distance = self.road.length - self.progress * self.road.length
+                distance = self.road.length - self.s
                 self.decelerate(0, distance)
             # If there is a car in front on another road, match its speed,
             else:
@@ -137,7 +217,7 @@ class Car:
 
         # Wait if necessary.
         if self.wait(in_roads):
-            distance = self.road.length - self.progress * self.road.length
+            distance = self.road.length - self.s
             self.decelerate(0, distance)
         # If there is no car in front and no wait, accelerate to the max.
         elif self.road.green:
@@ -150,7 +230,7 @@ class Car:
         self.v = min(self.v, self.max)
         self.v = max(self.v, 0)
 
-    def decelerate(self, aim_speed, distance, min_des_dist=45):
+    def decelerate(self, aim_speed, distance, min_des_dist=STOP_DIST):
         """
         Decelerate according to a desired speed and where on the road this
         should be reached. For example: can be used to decelerate according
@@ -163,7 +243,7 @@ class Car:
         des_dist = (
             min_des_dist
             + react_dist
-            + (self.v * speed_div) / (2 * np.sqrt(self.max_a * self.max_brake))
+            + (self.v * speed_div) / self.brake_term
         )
         # Get the acceleration.
         self.a = self.max_a * (
@@ -174,6 +254,26 @@ class Car:
             self.v = 0
             self.a = 0
 
+    def should_sleep(self):
+        """
+        Check if the car would stay stopped until its light turns green: it
+        has stopped right before a red light. Such a car is set to a speed
+        of 0 every step, so skipping it does not change the simulation.
+        """
+        return (
+            not self.road.green
+            and self.v == 0
+            and self.road.length - self.s < STOP_DIST
+        )
+
+    def sleep(self):
+        """Skip the car until it is woken."""
+        self.dormant = True
+
+    def wake(self):
+        """Let the car be updated again."""
+        self.dormant = False
+
     def wait(self, in_roads):
         """Decide if a car should wait."""
         if not self.road.green:
@@ -186,7 +286,7 @@ class Car:
 
                 if road.green and road in in_roads:
                     for car in road.cars:
-                        if dist(car.pos, car.road.end) < 80:
+                        if car.road.length - car.s < 80:
                             return True
         return False
 
@@ -196,42 +296,31 @@ class Car:
         and the distance between the cars.
         """
         nearest = None
-        nearest_progress = 1
 
         # Check the cars on the current road first.
+        nearest_s = self.road.length
         for car in self.road.cars:
-            if (
-                car.progress > self.progress
-                and car.progress < nearest_progress
-            ):
-                nearest_progress = car.progress
+            if self.s < car.s < nearest_s:
+                nearest_s = car.s
                 nearest = car
 
         # Return if there is.
         if nearest:
-            return (
-                nearest,
-                nearest_progress * car.road.length
-                - self.progress * self.road.length,
-            )
+            return nearest, nearest_s - self.s
 
-        # Check the other roads in the path.
+        # Check the other roads in the path. The distance is the sum of the
+        # road lengths minus the distance the cars have driven.
+        distance = self.road.length - self.s
         for road in self.path[self.index + 1 :]:
-            road_index = self.path.index(road)
+            nearest_s = road.length
             for car in road.cars:
-                if car.progress < nearest_progress:
-                    nearest_progress = car.progress
+                if car.s < nearest_s:
+                    nearest_s = car.s
                     nearest = car
 
             if nearest:
-                # Calculate the distance between. This is the sum of the road
-                # lengths minus the progress the cars have made.
-                distance = sum(
-                    [r.length for r in self.path[self.index : road_index]]
-                )
-                distance += nearest.progress * nearest.road.length
-                distance -= self.progress * self.road.length
-                return nearest, distance
+                return nearest, distance + nearest_s
+            distance += road.length
 
         return None, 0
 
@@ -3,27 +3,115 @@ import numpy as np
 import matplotlib.pyplot as plt
 from simulation import Simulation, pygame
 from sys import stdout as out
+from metrics import MetricsServer
+from kpi import KPICollector
 
 # Set the number of frames per second
 FPS = 30
 
+# Server to watch the progress of the experiment, if it is enabled.
+metrics = None
 
-def experiment(ref_data, change, secs, reps, filename):
+
+def simulate(change, value, secs, rep=0, metrics=None, crn=False):
+    """
+    Run a single simulation for a number of seconds, with the input changed
+    to the given value. Returns the finished simulation. With common random
+    numbers (crn), every input uses the same random streams for the same
+    repetition, and every odd repetition is antithetic to the one before.
+    """
+    # All types of pollution are kept for the table of runs, the first one
+    # is CO2.
+    sim = Simulation("", save_pol_map=False)
+    change(sim, value)
+    if crn:
+        sim.set_streams(rep // 2, antithetic=rep % 2 == 1)
+
+    for step in range(sim.FPS * secs):
+        sim.simulate()
+        # Update the metrics every simulated second.
+        if metrics and step % sim.FPS == 0:
+            sim.flush_pollution()
+            metrics.update(sim, input=value, rep=rep)
+
+    sim.flush_pollution()
+    return sim
+
+
+# The columns of the table of runs, which the surrogate model is fitted to.
+RUN_COLUMNS = "light_duration,car_gen_prob,secs,pollutant,value"
+
+
+def save_run(sim, secs, filename):
+    """
+    Add the inputs of a simulation and its pollution per car per second of
+    every type to the table of runs filename + "_runs.csv".
+    """
+    with open(filename + "_runs.csv", "a") as file:
+        for pol_map in sim.pol_maps:
+            value = pol_map.total_pol / (max(sim.num_cars, 1) * secs)
+            file.write(
+                f"{sim.light_duration},{sim.car_gen_prob},{secs},"
+                f"{pol_map.pol_type},{value}\n"
+            )
+
+
+def co2_per_car_per_sec(sim, secs):
+    """The average CO2 emission per car per second of a simulation."""
+    return sim.pol_maps[0].total_pol / (sim.num_cars * secs)
+
+
+def variance_reduction(data):
+    """
+    Estimate how much common random numbers with antithetic pairs reduce
+    the variance of the difference between the means of neighbouring
+    inputs. Returns the variance of that difference if every repetition
+    were independent, divided by the variance with common random numbers,
+    for every pair of neighbouring inputs and for all pairs together. A
+    ratio is NaN if the differences do not vary with common random numbers,
+    like for inputs that give the same results.
+    """
+    # The average of an antithetic pair is an independent repetition.
+    data = np.asarray(data)
+    reps = data.shape[1] // 2 * 2
+    pairs = (data[:, 0:reps:2] + data[:, 1:reps:2]) / 2
+
+    independent, common = [], []
+    for i in range(len(data) - 1):
+        var_a = np.var(data[i, :reps], ddof=1)
+        var_b = np.var(data[i + 1, :reps], ddof=1)
+        independent.append((var_a + var_b) / reps)
+        common.append(np.var(pairs[i] - pairs[i + 1], ddof=1) / len(pairs[i]))
+
+    def ratio(a, b):
+        return a / b if b > 0 else np.nan
+
+    ratios = [ratio(a, b) for a, b in zip(independent, common)]
+    return ratios, ratio(sum(independent), sum(common))
+
+
+def experiment(ref_data, change, secs, reps, filename, crn=False):
     """
     Experiment to find average CO2 emission per second. Each simulation
     is run for a specified number of seconds, average is taken over
-    a specified number of repetitions.
+    a specified number of repetitions. The traffic KPIs and the pollution
+    of every simulation are written to tables. With common random numbers
+    (crn), the variance reduction is written to a file as well.
     """
+    with open(filename + "_kpi.csv", "w") as file:
+        file.write("input,rep," + ",".join(KPICollector.COLUMNS) + "\n")
+    with open(filename + "_runs.csv", "w") as file:
+        file.write(RUN_COLUMNS + "\n")
+
     data = [[] for _ in ref_data]
     for i in range(len(ref_data)):
         for j in range(reps):
-            sim = Simulation("CO2", save_pol_map=False)
-            change(sim, ref_data[i])
-
-            for _ in range(sim.FPS * secs):
-                sim.simulate()
-
-            data[i].append(sim.pol_maps[0].total_pol / (sim.num_cars * secs))
+            sim = simulate(change, ref_data[i], secs, j, metrics, crn)
+            data[i].append(co2_per_car_per_sec(sim, secs))
+            save_run(sim, secs, filename)
+            with open(filename + "_kpi.csv", "a") as file:
+                row = [ref_data[i], j] + sim.kpi.row()
+                file.write(",".join(str(x) for x in row) + "\n")
             out.write(f"\rInput={ref_data[i]}: {(j + 1) / reps * 100:.0f}%")
             out.flush()
         print()
@@ -31,9 +119,137 @@ def experiment(ref_data, change, secs, reps, filename):
         with open(filename + ".txt", "a") as file:
             file.write(" ".join(str(d) for d in data[i]) + "\n")
 
+    # At least two antithetic pairs are needed to estimate the variance.
+    if crn and reps >= 4:
+        ratios, total = variance_reduction(data)
+        with open(filename + "_variance.txt", "w") as file:
+            for i, ratio in enumerate(ratios):
+                file.write(f"{ref_data[i]} {ref_data[i + 1]} {ratio}\n")
+        if np.isnan(total):
+            print("The differences do not vary with common random numbers")
+        else:
+            print(f"Variance reduction of differences: {total:.2f}x")
+
     return np.asarray(data)
 
 
+def adaptive_experiment(
+    grid,
+    change,
+    secs,
+    reps,
+    budget,
+    filename,
+    measure=co2_per_car_per_sec,
+    metrics=None,
+    crn=False,
+):
+    """
+    Experiment that runs only part of a grid of inputs. It starts with a
+    coarse part of the grid, and then only adds the input in the middle of
+    the interval where the emission changes fastest or is most uncertain.
+    Every input gets a specified number of repetitions, and it stops when
+    the number of simulations would exceed the budget. Returns the inputs
+    that were run and the data for each of them. The pollution of every
+    simulation is written to a table, like in experiment. The budget must
+    cover the repetitions of the first inputs.
+    """
+    # Start with 5 evenly spaced inputs, including both ends of the grid.
+    start = sorted(set(np.linspace(0, len(grid) - 1, 5).round().astype(int)))
+    if budget < len(start) * reps:
+        raise ValueError(
+            f"A budget of {budget} simulations is too small, the first "
+            f"{len(start)} inputs need {len(start) * reps}."
+        )
+
+    data = {}
+    with open(filename + "_runs.csv", "w") as file:
+        file.write(RUN_COLUMNS + "\n")
+
+    def run(k):
+        """Run the repetitions for input k of the grid."""
+        data.setdefault(k, [])
+        for _ in range(reps):
+            sim = simulate(change, grid[k], secs, len(data[k]), metrics, crn)
+            data[k].append(measure(sim, secs))
+            save_run(sim, secs, filename)
+        out.write(f"\rInput={grid[k]}: {len(data[k])} repetitions")
+        out.flush()
+        print()
+
+    def stderr(k):
+        """
+        The standard error of the mean of input k. An input with a single
+        repetition gets the largest spread of the other inputs.
+        """
+        if len(data[k]) > 1:
+            std = np.std(data[k], ddof=1)
+        else:
+            spreads = [np.std(d, ddof=1) for d in data.values() if len(d) > 1]
+            std = max(spreads, default=0)
+        return std / np.sqrt(len(data[k]))
+
+    for k in start:
+        run(k)
+    runs = len(data) * reps
+
+    while runs + reps <= budget:
+        done = sorted(data)
+        intervals = [(a, b) for a, b in zip(done, done[1:]) if b - a > 1]
+
+        if intervals:
+            # Split the interval with the largest change in the mean,
+            # plus the uncertainty of the means at both ends.
+            a, b = max(
+                intervals,
+                key=lambda ab: abs(np.mean(data[ab[1]]) - np.mean(data[ab[0]]))
+                + stderr(ab[0])
+                + stderr(ab[1]),
+            )
+            run((a + b) // 2)
+        else:
+            # The whole grid is run, repeat the most uncertain input.
+            run(max(done, key=stderr))
+        runs += reps
+
+    inputs = sorted(data)
+    with open(filename + ".txt", "w") as file:
+        for k in inputs:
+            file.write(f"{grid[k]} " + " ".join(str(d) for d in data[k]) + "\n")
+
+    best = min(inputs, key=lambda k: np.mean(data[k]))
+    print(f"Ran {runs} simulations, lowest emission at input {grid[best]}")
+
+    return [grid[k] for k in inputs], [data[k] for k in inputs]
+
+
+def save_adaptive_image(
+    ref_data,
+    data,
+    caption,
+    ref_data_label,
+    filename,
+    data_label="CO2 emission per car (mg/second)",
+):
+    """Plot the results of an adaptive experiment, the inputs can be uneven."""
+    means = [np.mean(d) for d in data]
+    plt.figure(figsize=(10, 7))
+    plt.errorbar(
+        ref_data, means, yerr=[np.std(d) for d in data], capsize=5, marker="o"
+    )
+
+    # Mark the input with the lowest emission.
+    best = int(np.argmin(means))
+    plt.plot(ref_data[best], means[best], "r*", markersize=15)
+
+    plt.title(
+        "The average CO2 emission based on " + caption,
+    )
+    plt.xlabel(ref_data_label)
+    plt.ylabel(data_label)
+    plt.savefig(filename + ".png")
+
+
 def save_image(ref_data, data, caption, ref_data_label, filename):
     # Create image
     plt.figure(figsize=(10, 7))
@@ -70,12 +286,31 @@ def change_lightdur(sim, dur):
     sim.FPS = FPS
 
 
-def experiment_lights(secs, reps, filename):
+def experiment_lights(secs, reps, filename, budget=None, crn=False):
     """
     Experiment to find CO2 emission based on the duration of time
     each light is green, before switching to another light.
-    Returns average CO2 emission per second.
+    Returns average CO2 emission per second. If a budget is given,
+    only the most informative durations are run.
     """
+    if budget:
+        save_adaptive_image(
+            *adaptive_experiment(
+                [5 + i for i in range(31)],
+                change_lightdur,
+                secs,
+                reps,
+                budget,
+                filename,
+                metrics=metrics,
+                crn=crn,
+            ),
+            "the length of the time between switching traffic lights",
+            "Traffic light duration (seconds)",
+            filename,
+        )
+        return
+
     trafficlight_duration = [5 + (3 * i) for i in range(11)]
 
     # Write the data to a file
@@ -85,7 +320,7 @@ def experiment_lights(secs, reps, filename):
     save_image(
         trafficlight_duration,
         experiment(
-            trafficlight_duration, change_lightdur, secs, reps, filename
+            trafficlight_duration, change_lightdur, secs, reps, filename, crn
         ),
         "the length of the time between switching traffic lights",
         "Traffic light duration (seconds)",
@@ -106,12 +341,33 @@ def change_traffic(sim, prob):
     sim.FPS = FPS
 
 
-def experiment_traffic(secs, reps, filename):
+def experiment_traffic(secs, reps, filename, budget=None, crn=False):
     """
     Experiment to find CO2 emission based on the probability of cars
     entering traffic per second, thus on how busy the intersection is.
-    Returns average CO2 emission per second.
+    Returns average CO2 emission per second. If a budget is given,
+    only the most informative probabilities are run.
     """
+    if budget:
+        probs, data = adaptive_experiment(
+            [i for i in range(4, 33)],
+            change_traffic,
+            secs,
+            reps,
+            budget,
+            filename,
+            metrics=metrics,
+            crn=crn,
+        )
+        save_adaptive_image(
+            [FPS * p / 100 for p in probs],
+            data,
+            "how busy traffic is at the intersection.",
+            "Expected number of cars per second (cars)",
+            filename,
+        )
+        return
+
     prob_car_per_step = [4 * i for i in range(1, 9)]
     prob_car_per_sec = [FPS * p // 100 for p in prob_car_per_step]
 
@@ -120,7 +376,9 @@ def experiment_traffic(secs, reps, filename):
 
     save_image(
         prob_car_per_sec,
-        experiment(prob_car_per_step, change_traffic, secs, reps, filename),
+        experiment(
+            prob_car_per_step, change_traffic, secs, reps, filename, crn
+        ),
         "how busy traffic is at the intersection.",
         "Expected number of cars per second (cars)",
         filename,
@@ -131,16 +389,38 @@ def main():
     # Switches the simulation visibility off
     pygame.quit()
 
+    # Serve the metrics of the running simulation on the given port.
+    global metrics
+    if "--metrics" in sys.argv:
+        port = int(sys.argv[sys.argv.index("--metrics") + 1])
+        metrics = MetricsServer(port)
+        metrics.start()
+
     # Specifies the number of repetitions and simulation duration
     reps = int(sys.argv[3])
     secs = int(sys.argv[2])
 
+    # Only run the most informative inputs within a budget of simulations.
+    budget = None
+    if "adaptive" in sys.argv:
+        budget = int(sys.argv[sys.argv.index("adaptive") + 1])
+    suffix = f"_{budget}b" if budget else ""
+
+    # Use the same random numbers for every input, in antithetic pairs.
+    crn = "crn" in sys.argv
+    if crn:
+        suffix += "_crn"
+
     # Run experiment based on time between light switches
     # or run experiment based on business of the road
     if len(sys.argv) > 1 and sys.argv[1] == "light":
-        experiment_lights(secs, reps, f"exp_light_{secs}s_{reps}r")
+        experiment_lights(
+            secs, reps, f"exp_light_{secs}s_{reps}r{suffix}", budget, crn
+        )
     else:
-        experiment_traffic(secs, reps, f"exp_traffic_{secs}s_{reps}r")
+        experiment_traffic(
+            secs, reps, f"exp_traffic_{secs}s_{reps}r{suffix}", budget, crn
+        )
 
 
 if __name__ == "__main__":
@@ -3,10 +3,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 from simulation import Simulation, pygame
 from sys import stdout as out
+from metrics import MetricsServer
+from experiment import adaptive_experiment, save_adaptive_image
 
 # Set the number of frames per second
 FPS = 30
 
+# Server to watch the progress of the experiment, if it is enabled.
+metrics = None
+
 
 def experiment(ref_data, change, secs, reps, filename):
     """
@@ -20,8 +25,13 @@ def experiment(ref_data, change, secs, reps, filename):
             sim = Simulation("CO2", save_pol_map=False)
             change(sim, ref_data[i])
 
-            for _ in range(sim.FPS * secs):
+            for step in range(sim.FPS * secs):
                 sim.simulate()
+                # Update the metrics every simulated second.
+                if metrics and step % sim.FPS == 0:
+                    sim.flush_pollution()
+                    metrics.update(sim, input=ref_data[i], rep=j)
+            sim.flush_pollution()
 
             data[i].append(sim.pol_maps[0].total_pol / sim.num_cars)
             out.write(f"\rInput={ref_data[i]}: {(j + 1) / reps * 100:.0f}%")
@@ -34,6 +44,11 @@ def experiment(ref_data, change, secs, reps, filename):
     return np.asarray(data)
 
 
+def co2_per_car(sim, secs):
+    """The average CO2 emission per car of a simulation."""
+    return sim.pol_maps[0].total_pol / sim.num_cars
+
+
 def save_image(ref_data, data, caption, ref_data_label, filename):
     # Create image
     plt.figure(figsize=(10, 7))
@@ -70,14 +85,36 @@ def change_lightdur(sim, dur):
     sim.FPS = FPS
 
 
-def experiment_lights(secs, reps, filename):
+def experiment_lights(secs, reps, filename, budget=None):
     """
     Experiment to find CO2 emission based on the duration of time
     each light is green, before switching to another light.
-    Returns average CO2 emission per second.
+    Returns average CO2 emission per second. If a budget is given,
+    only the most informative durations are run.
     """
     trafficlight_duration = [5 + (1 * i) for i in range(21)]
 
+    if budget:
+        durations, data = adaptive_experiment(
+            trafficlight_duration,
+            change_lightdur,
+            secs,
+            reps,
+            budget,
+            filename,
+            co2_per_car,
+            metrics,
+        )
+        save_adaptive_image(
+            [x - 4 for x in durations],
+            data,
+            "the length of the time between switching traffic lights",
+            "Traffic light duration (seconds)",
+            filename,
+            "CO2 emission per car (mg)",
+        )
+        return
+
     # Write the data to a file
     with open(filename + ".txt", "w") as file:
         file.write(" ".join(str(d) for d in trafficlight_duration) + "\n")
@@ -106,13 +143,35 @@ def change_traffic(sim, prob):
     sim.FPS = FPS
 
 
-def experiment_traffic(secs, reps, filename):
+def experiment_traffic(secs, reps, filename, budget=None):
     """
     Experiment to find CO2 emission based on the probability of cars
     entering traffic per second, thus on how busy the intersection is.
-    Returns average CO2 emission per second.
+    Returns average CO2 emission per second. If a budget is given,
+    only the most informative probabilities are run.
     """
     prob_car_per_step = [5/18 + 1/24 * i for i in range(21)]
+
+    if budget:
+        probs, data = adaptive_experiment(
+            prob_car_per_step,
+            change_traffic,
+            secs,
+            reps,
+            budget,
+            filename,
+            co2_per_car,
+            metrics,
+        )
+        save_adaptive_image(
+            [round(FPS * p * 60 / 100, 2) for p in probs],
+            data,
+            "how busy traffic is at the intersection.",
+            "Expected number of cars per minute (cars)",
+            filename,
+            "CO2 emission per car (mg)",
+        )
+        return
     cars_per_min = [round(FPS * p * 60 / 100,2) for p in prob_car_per_step]
 
     with open(filename + ".txt", "w") as file:
@@ -130,16 +189,33 @@ def main():
     # Switches the simulation visibility off
     pygame.quit()
 
+    # Serve the metrics of the running simulation on the given port.
+    global metrics
+    if "--metrics" in sys.argv:
+        port = int(sys.argv[sys.argv.index("--metrics") + 1])
+        metrics = MetricsServer(port)
+        metrics.start()
+
     # Specifies the number of repetitions and simulation duration
     reps = int(sys.argv[3])
     secs = int(sys.argv[2])
 
+    # Only run the most informative inputs within a budget of simulations.
+    budget = None
+    if "adaptive" in sys.argv:
+        budget = int(sys.argv[sys.argv.index("adaptive") + 1])
+    suffix = f"_{budget}b" if budget else ""
+
     # Run experiment based on time between light switches
     # or run experiment based on business of the road
     if len(sys.argv) > 1 and sys.argv[1] == "light":
-        experiment_lights(secs, reps, f"exp_light_{secs}s_{reps}r")
+        experiment_lights(
+            secs, reps, f"exp_light_{secs}s_{reps}r{suffix}", budget
+        )
     elif len(sys.argv) > 1 and sys.argv[1] == "traffic":
-        experiment_traffic(secs, reps, f"exp_traffic_{secs}s_{reps}r")
+        experiment_traffic(
+            secs, reps, f"exp_traffic_{secs}s_{reps}r{suffix}", budget
+        )
 
 
 if __name__ == "__main__":
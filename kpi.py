@@ -0,0 +1,190 @@
+"""
+This file contains a collector of traffic KPIs. The KPIs are updated while
+the simulation runs: when a car is updated, when it changes roads and when it
+leaves the network. No states are stored, so the KPIs of a run of any length
+are available at the end of it without going through the run again.
+"""
+
+import math
+
+from metrics import QUEUE_SPEED
+
+
+class Welford:
+    """The running mean and variance of a series of values."""
+
+    def __init__(self) -> None:
+        self.n = 0
+        self.mean = 0
+        self.m2 = 0
+
+    def add(self, x):
+        """Add a value, with Welford's algorithm."""
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def var(self):
+        """The sample variance of the values."""
+        return self.m2 / (self.n - 1) if self.n > 1 else 0
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+
+class Histogram:
+    """Counts of values in bins of equal width, starting at 0."""
+
+    def __init__(self, width, bins) -> None:
+        """Sets the width and the number of bins. The last bin is open."""
+        self.width = width
+        self.counts = [0] * bins
+
+    def add(self, x):
+        i = min(max(int(x / self.width), 0), len(self.counts) - 1)
+        self.counts[i] += 1
+
+
+class Statistic:
+    """The running mean, variance and histogram of a series of values."""
+
+    def __init__(self, width, bins) -> None:
+        self.moments = Welford()
+        self.histogram = Histogram(width, bins)
+
+    def add(self, x):
+        self.moments.add(x)
+        self.histogram.add(x)
+
+    def summary(self):
+        return {
+            "n": self.moments.n,
+            "mean": self.moments.mean,
+            "std": self.moments.std,
+            "bin_width": self.histogram.width,
+            "histogram": self.histogram.counts,
+        }
+
+
+class KPICollector:
+    """
+    Collect the travel time, the delay compared to driving the path without
+    other cars and traffic lights, and the number of stops of every car that
+    leaves the network, the longest queue on every incoming road and the
+    number of cars served in every phase of the traffic lights.
+    """
+
+    def __init__(self, sim) -> None:
+        self.sim = sim
+        self.in_roads = sim.network.in_roads
+
+        # In seconds, and in stops.
+        self.travel_time = Statistic(5, 24)
+        self.delay = Statistic(5, 24)
+        self.stops = Statistic(1, 10)
+
+        # The number of queued cars on every incoming road now, and the
+        # largest number so far, by the index of the road.
+        self.queue = [0] * len(self.in_roads)
+        self.max_queue = [0] * len(self.in_roads)
+
+        # The number of cars that passed the lights in every phase. A phase
+        # is named after the incoming roads that have green, like "0+1".
+        self.served = {}
+
+    def road_index(self, road):
+        """The index of an incoming road, or None for other roads."""
+        for i, in_road in enumerate(self.in_roads):
+            if in_road is road:
+                return i
+        return None
+
+    def start(self, car):
+        """Start following a new car."""
+        car.kpi = self
+        car.kpi_start = self.sim.timer
+        car.kpi_free = self.free_time(car)
+        car.kpi_stops = 0
+        car.kpi_queued = False
+
+    def free_time(self, car):
+        """The time to drive the path of a car at its maximum speed."""
+        return sum(road.length for road in car.path) / car.max
+
+    def change_path(self, car):
+        """Measure the delay of a rerouted car against its new path."""
+        car.kpi_free = self.free_time(car)
+
+    def update(self, car):
+        """Update the stops and the queues after a car has moved."""
+        queued = car.v < QUEUE_SPEED
+        if queued == car.kpi_queued:
+            return
+        car.kpi_queued = queued
+        if queued:
+            car.kpi_stops += 1
+
+        i = self.road_index(car.road)
+        if i is not None:
+            self.queue[i] += 1 if queued else -1
+            self.max_queue[i] = max(self.max_queue[i], self.queue[i])
+
+    def change_road(self, car, old_road):
+        """Count a car that passed the lights, and move it between queues."""
+        i = self.road_index(old_road)
+        if i is None:
+            return
+        if car.kpi_queued:
+            self.queue[i] -= 1
+
+        phase = "+".join(
+            str(j) for j, road in enumerate(self.in_roads) if road.green
+        )
+        self.served[phase] = self.served.get(phase, 0) + 1
+
+    def finish(self, car):
+        """Add the KPIs of a car that left the network."""
+        travel_time = (self.sim.timer - car.kpi_start) / self.sim.FPS
+        self.travel_time.add(travel_time)
+        self.delay.add(travel_time - car.kpi_free)
+        self.stops.add(car.kpi_stops)
+
+    def summary(self):
+        """The KPIs of the run so far."""
+        return {
+            "travel_time": self.travel_time.summary(),
+            "delay": self.delay.summary(),
+            "stops": self.stops.summary(),
+            "max_queue": list(self.max_queue),
+            "served": dict(self.served),
+        }
+
+    # The columns of row.
+    COLUMNS = [
+        "finished",
+        "travel_time_mean",
+        "travel_time_std",
+        "delay_mean",
+        "delay_std",
+        "stops_mean",
+        "stops_std",
+        "max_queue",
+        "served",
+    ]
+
+    def row(self):
+        """The main KPIs of the run so far, as a row of a table."""
+        return [
+            self.travel_time.moments.n,
+            self.travel_time.moments.mean,
+            self.travel_time.moments.std,
+            self.delay.moments.mean,
+            self.delay.moments.std,
+            self.stops.moments.mean,
+            self.stops.moments.std,
+            max(self.max_queue),
+            sum(self.served.values()),
+        ]
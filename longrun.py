@@ -0,0 +1,159 @@
+"""
+This file contains a long running simulation, of hours or days, with demand
+and traffic light durations that change over the day. The changes are read
+from a profile file while the simulation runs, and the results are gathered
+in windows of time that are written to a file as soon as they are done. Only
+the current window is kept in memory, so the memory stays the same no matter
+how long the simulation runs.
+
+A profile is a csv file with lines of
+    time,car_gen_prob,light_duration
+where the time is in seconds since the start of the day. Every line holds
+until the time of the next line. After the last line the profile starts
+again for the next day.
+"""
+
+from simulation import Simulation, pygame
+from scheduler import METRICS
+
+import sys
+import time
+
+# The length of a day in seconds, the period of a profile.
+DAY = 24 * 60 * 60
+
+POL_TYPES = ["CO2", "NO", "HC", "CO"]
+
+
+def read_profile(filename):
+    """
+    Read a profile line by line, forever. Yields the simulated time (in
+    seconds since the start of the run), car_gen_prob and light_duration
+    of every change. Raises a ValueError if the profile has no changes.
+    """
+    day = 0
+    while True:
+        rows = 0
+        with open(filename) as file:
+            for line in file:
+                line = line.strip()
+                # Skip empty lines, comments and the header.
+                if not line or line.startswith("#") or line[0].isalpha():
+                    continue
+                secs, prob, dur = line.split(",")
+                rows += 1
+                yield day * DAY + float(secs), float(prob), float(dur)
+        if rows == 0:
+            raise ValueError(f"The profile {filename} has no changes.")
+        day += 1
+
+
+class Window:
+    """The results of a simulation over a window of time."""
+
+    def __init__(self, sim) -> None:
+        """Start a window at the current state of the simulation."""
+        self.start = sim.timer / sim.FPS
+        self.spawned = sim.num_cars
+        self.finished = sim.num_cars - sim.active_cars()
+        self.emissions = [pol_map.total_pol for pol_map in sim.pol_maps]
+
+        # Sums to average over the steps of the window.
+        self.steps = 0
+        self.cars = 0
+        self.car_gen_prob = 0
+        self.light_duration = 0
+
+    def step(self, sim):
+        """Add a step of the simulation to the window."""
+        self.steps += 1
+        self.cars += sim.active_cars()
+        self.car_gen_prob += sim.car_gen_prob
+        self.light_duration += sim.light_duration
+
+    def row(self, sim):
+        """The results of the window up to the current state of sim."""
+        sim.flush_pollution()
+        steps = max(self.steps, 1)
+        emissions = [
+            pol_map.total_pol - total
+            for pol_map, total in zip(sim.pol_maps, self.emissions)
+        ]
+        return [
+            self.start,
+            sim.timer / sim.FPS,
+            sim.num_cars - self.spawned,
+            sim.num_cars - sim.active_cars() - self.finished,
+            self.cars / steps,
+            self.car_gen_prob / steps,
+            self.light_duration / steps,
+        ] + emissions
+
+
+def long_run(profile, secs, output, window=300):
+    """
+    Simulate a number of seconds with the demand and light durations of
+    the profile, and write the results of every window to output.
+    """
+    sim = Simulation(save_pol_map=False)
+
+    changes = read_profile(profile)
+    _, sim.car_gen_prob, sim.light_duration = next(changes)
+    change = next(changes)
+    light_duration = sim.light_duration
+
+    with open(output, "w") as file:
+        file.write(
+            "start,end,spawned,finished,mean_cars,car_gen_prob,light_duration,"
+            + ",".join(POL_TYPES)
+            + "\n"
+        )
+
+        current = [Window(sim)]
+
+        def write_window(frame):
+            """Write the window to the file and start a new one."""
+            file.write(",".join(str(x) for x in current[0].row(sim)) + "\n")
+            file.flush()
+            current[0] = Window(sim)
+
+        frames = int(window * sim.FPS)
+        sim.scheduler.repeat(frames, frames, write_window, METRICS, "window")
+
+        for step in range(int(secs * sim.FPS)):
+            # Apply the changes of the profile that are due.
+            while change[0] <= step / sim.FPS:
+                _, car_gen_prob, light_duration = change
+                sim.set_car_gen_prob(car_gen_prob)
+                change = next(changes)
+
+            # Only change the light duration when a cycle has ended.
+            if light_duration != sim.light_duration and sim.cycle_ended():
+                sim.set_light_duration(light_duration)
+
+            sim.simulate()
+            current[0].step(sim)
+
+        # Write the last window, also if only part of it was simulated. The
+        # other events that are due are after the end of the run.
+        if current[0].steps > 0:
+            write_window(sim.timer)
+
+
+def main():
+    # Switches the simulation visibility off
+    pygame.quit()
+
+    # The profile, the number of hours to simulate and the output file.
+    profile = sys.argv[1]
+    hours = float(sys.argv[2])
+    output = sys.argv[3]
+    window = int(sys.argv[4]) if len(sys.argv) > 4 else 300
+
+    start = time.time()
+    long_run(profile, hours * 60 * 60, output, window)
+    print(f"Simulated {hours} hours in {time.time() - start:.0f} seconds")
+
+
+if __name__ == "__main__":
+    main()
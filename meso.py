@@ -0,0 +1,199 @@
+"""
+This file contains a mesoscopic model for roads that are far from traffic
+lights. On such a road the cars are not moved every frame. A car that drives
+onto it is put in a first in, first out queue with the frame it entered, and
+leaves the road after the time it takes to drive over it, or later if the car
+in front of it left just before. Cars near the traffic lights are still
+simulated one by one, and a car that leaves a queue is handed back to that
+simulation at the start of its next road. To draw and record the queued
+cars, they are moved along the road as they would drive over it freely, and
+wait at the end of the road behind each other.
+"""
+
+from car import EM_TYPES, STOP_DIST, driving_state
+from pollution import BIN_LENGTH
+
+from collections import deque
+import numpy as np
+
+# The speeds a free drive starts from are rounded to this step, in pixels per
+# second, so cars with almost the same speeds share a free drive.
+SPEED_STEP = 0.5
+
+
+class QueueRoad:
+    """A road on which cars are only kept as a queue of entry and exit frames."""
+
+    def __init__(self, road, fps) -> None:
+        """Sets the road and the number of frames per second."""
+        self.road = road
+        self.fps = fps
+
+        # The cars on the road as [exit frame, free exit frame, car, shares,
+        # speed, key], in the order they entered. The free exit frame is when
+        # the car would have left without waiting for the car in front,
+        # shares is the share of the time in every driving state, speed the
+        # speed of the car at the end of the road and key the key of its free
+        # drive.
+        self.queue = deque()
+        self.last_exit = 0
+
+        # The free drives over the road, as [frames, shares, speed, states]
+        # by the rounded start speed, maximum speed, maximum acceleration and
+        # delta of the car. The states are only made when they are needed.
+        self.drives = {}
+
+        # The distances of the centers of the bins of the road, to spread the
+        # pollution of a car over the road.
+        n_bins = max(int(np.ceil(road.length / BIN_LENGTH)), 1)
+        self.distances = (np.arange(n_bins) + 0.5) * BIN_LENGTH
+
+    def __len__(self):
+        return len(self.queue)
+
+    def drive(self, key, keep_states=False):
+        """
+        Drive over the empty road from the start speed of a key with the
+        same steps as Car, without looking at other cars. Returns the number
+        of frames it takes, the share of the frames in every driving state,
+        the final speed and, if keep_states is True, the distance, speed and
+        acceleration in every frame.
+        """
+        v, max_speed, max_a, delta = key
+        dt = 1 / self.fps
+        distance, frames = 0, 0
+        counts = {}
+        states = []
+        while distance <= self.road.length:
+            a = max_a * (1 - (v / max_speed) ** delta)
+            v = max(min(v + a * dt, max_speed), 0)
+            distance += v * dt
+            frames += 1
+            state = driving_state(v, a)
+            counts[state] = counts.get(state, 0) + 1
+            if keep_states:
+                states.append((min(distance, self.road.length), v, a))
+            # A car that can not move would never leave the road.
+            if v == 0:
+                break
+        shares = {s: n / frames for s, n in counts.items()}
+        return frames, shares, v, np.array(states) if keep_states else None
+
+    def free_drive(self, car):
+        """
+        The free drive of the car over the road, which is shared with the
+        cars that start with about the same speeds. Returns its key, the
+        number of frames, the shares of the driving states and the final
+        speed.
+        """
+        max_speed = round(car.max / SPEED_STEP) * SPEED_STEP
+        v = min(round(car.v / SPEED_STEP) * SPEED_STEP, max_speed)
+        key = (v, max_speed, car.max_a, car.delta)
+        if key not in self.drives:
+            self.drives[key] = list(self.drive(key))
+        frames, shares, speed, _ = self.drives[key]
+        return key, frames, shares, speed
+
+    def states(self, key):
+        """The distance, speed and acceleration in every frame of a drive."""
+        drive = self.drives[key]
+        if drive[3] is None:
+            drive[3] = self.drive(key, keep_states=True)[3]
+        return drive[3]
+
+    def enter(self, car, frame):
+        """
+        Add a car that drove onto the road at frame. It leaves the road after
+        driving over it freely, but not before the car in front has left and
+        driven a gap of STOP_DIST.
+        """
+        key, frames, shares, speed = self.free_drive(car)
+        headway = max(int(round(STOP_DIST / max(speed, 1) * self.fps)), 1)
+        free_exit = frame + frames
+        exit = max(free_exit, self.last_exit + headway)
+        self.last_exit = exit
+
+        car.em_state = None
+        car.em_since = frame
+        self.queue.append([exit, free_exit, car, shares, speed, key])
+
+    def add_pollution(self, sim, entry, until):
+        """
+        Add the pollution of a queued car up to frame until, spread evenly
+        over the road. The car is idle after its free exit frame.
+        """
+        _, free_exit, car, shares, _, _ = entry
+        n_bins = len(self.distances)
+        for shares, end in [(shares, min(until, free_exit)), ({"idle": 1}, until)]:
+            frames = end - car.em_since
+            if frames <= 0:
+                continue
+            for pol_map in sim.pol_maps:
+                em_type = EM_TYPES[pol_map.pol_type]
+                rate = sum(getattr(em_type, s) * x for s, x in shares.items())
+                levels = np.full(n_bins, rate * frames * sim.dt / n_bins)
+                pol_map.add_road_pollution(
+                    self.road, self.distances, levels, sim.pol_spread
+                )
+            car.em_since = end
+
+    def flush(self, sim, until):
+        """Add the pollution of every queued car up to frame until."""
+        for entry in self.queue:
+            self.add_pollution(sim, entry, until)
+
+    def update(self, frame):
+        """
+        Move the cars that are on the road at frame to where they would be,
+        for drawing and recording. A car drives as it would over the empty
+        road, and then waits STOP_DIST behind the car in front. A car that
+        enters the road after frame stays where it was handed over. Returns
+        the cars that are on the road at frame.
+        """
+        cars = []
+        for i, (_, free_exit, car, _, _, key) in enumerate(self.queue):
+            states = self.states(key)
+            k = frame - (free_exit - len(states))
+            if k < 0:
+                continue
+            if frame < free_exit:
+                car.s, car.v, car.a = states[k]
+            else:
+                car.s, car.v, car.a = self.road.length, 0, 0
+            car.s = min(car.s, max(self.road.length - i * STOP_DIST, 0))
+            cars.append(car)
+        return cars
+
+    def cars(self):
+        """The queued cars, in the order they entered."""
+        return [entry[2] for entry in self.queue]
+
+    def step(self, sim):
+        """
+        Let the cars that are due leave the road. A car that drives on to
+        another road is handed back to sim, if there is space on that road.
+        Returns the cars that left the network.
+        """
+        done = []
+        while self.queue and self.queue[0][0] <= sim.timer:
+            _, _, car, _, speed, _ = entry = self.queue[0]
+            nxt = car.index + 1
+            if nxt < len(car.path) and car.path[nxt].full():
+                # Wait for space on the next road, the cars behind wait too.
+                break
+
+            self.queue.popleft()
+            self.add_pollution(sim, entry, sim.timer + 1)
+            # A car that had to wait starts from standstill.
+            car.v = speed if entry[0] == entry[1] else 0
+            car.a = 0
+
+            # Put the car back on the road so it changes roads in the same
+            # way as a car that is simulated one by one.
+            self.road.cars.append(car)
+            car.s = self.road.length
+            if car.change_road():
+                done.append(car)
+            else:
+                sim.cars.append(car)
+        return done
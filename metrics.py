@@ -0,0 +1,105 @@
+"""
+This file contains a small local HTTP server to watch a running simulation.
+The server runs an asyncio event loop in a background thread, so it never
+blocks the simulation loop. The simulation only hands over a new snapshot of
+its metrics every now and then.
+
+GET /        returns the latest metrics as JSON.
+GET /stream  keeps the connection open and sends the metrics every second.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+# Cars slower than this (in pixels per second) are counted as queued.
+QUEUE_SPEED = 10
+
+
+class MetricsServer:
+    """Serve the metrics of a running simulation over HTTP."""
+
+    def __init__(self, port=8000, host="127.0.0.1") -> None:
+        """Sets the address to serve on."""
+        self.port = port
+        self.host = host
+
+        # The latest snapshot of the metrics. It is only ever replaced as a
+        # whole, so the server thread always reads a complete snapshot.
+        self.metrics = {}
+
+        # Used to determine the number of steps per second.
+        self.last_time = time.time()
+        self.last_timer = 0
+
+    def start(self):
+        """Start the server in a background thread."""
+        thread = threading.Thread(target=asyncio.run, args=(self.serve(),))
+        thread.daemon = True
+        thread.start()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """Answer a single HTTP request."""
+        request = await reader.readline()
+        # Skip the headers of the request.
+        while (await reader.readline()).strip():
+            pass
+
+        path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+        try:
+            if path == "/stream":
+                writer.write(
+                    b"HTTP/1.0 200 OK\r\n"
+                    b"Content-Type: application/x-ndjson\r\n\r\n"
+                )
+                while True:
+                    writer.write(json.dumps(self.metrics).encode() + b"\n")
+                    await writer.drain()
+                    await asyncio.sleep(1)
+            else:
+                body = json.dumps(self.metrics).encode()
+                writer.write(
+                    b"HTTP/1.0 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def update(self, sim, **extra):
+        """
+        Make a new snapshot of the metrics of the simulation. Extra keyword
+        arguments, like the current input of an experiment, are added to it.
+        """
+        now = time.time()
+        steps = sim.timer - self.last_timer
+        # The timer restarts for every new simulation.
+        if steps < 0:
+            steps = sim.timer
+        steps_per_sec = steps / max(now - self.last_time, 1e-9)
+        self.last_time = now
+        self.last_timer = sim.timer
+
+        queues = {}
+        for i, road in enumerate(sim.network.in_roads):
+            queues[i] = sum(1 for car in road.cars if car.v < QUEUE_SPEED)
+
+        self.metrics = {
+            "sim_time": sim.timer / sim.FPS,
+            "steps_per_sec": steps_per_sec,
+            "cars": sim.active_cars(),
+            "cars_spawned": sim.num_cars,
+            "emissions": {m.pol_type: m.total_pol for m in sim.pol_maps},
+            "queues": queues,
+            **extra,
+        }
@@ -1,4 +1,61 @@
-from numpy import infty
+from numpy import infty, pi
+
+# The turning movements of a path, and how likely each one is by default.
+MOVEMENTS = ["right", "straight", "left", "u-turn"]
+MOVEMENT_PROBS = {"right": 0.3, "straight": 0.3, "left": 0.3, "u-turn": 0.1}
+
+
+def movement(path):
+    """Get the turning movement of a path from the angle it turns."""
+    # The angle between the first and the last road, between -pi and pi.
+    # Angles increase counterclockwise, so a right turn is negative.
+    turn = (path[-1].angle - path[0].angle + pi) % (2 * pi) - pi
+    if abs(turn) < pi / 4:
+        return "straight"
+    if abs(turn) > 3 * pi / 4:
+        return "u-turn"
+    return "right" if turn < 0 else "left"
+
+
+class AliasTable:
+    """
+    Sample from a discrete distribution in constant time, with Vose's
+    alias method.
+    """
+
+    def __init__(self, weights):
+        """
+        Make the table for the given (not necessarily normalised) weights.
+        Raises a ValueError if the weights do not add up to more than 0.
+        """
+        n = len(weights)
+        total = sum(weights)
+        if n == 0 or total <= 0:
+            raise ValueError("The weights must add up to more than 0.")
+        scaled = [w * n / total for w in weights]
+
+        self.prob = [1] * n
+        self.alias = list(range(n))
+
+        # Pair every entry with less than average weight with one with more.
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1
+            if scaled[l] < 1:
+                small.append(l)
+            else:
+                large.append(l)
+
+    def sample(self, rng):
+        """Sample an index, using a single uniform number of rng."""
+        u = rng.random() * len(self.prob)
+        i = min(int(u), len(self.prob) - 1)
+        return i if u - i < self.prob[i] else self.alias[i]
 
 
 class Network:
@@ -12,6 +69,16 @@ class Network:
         self.out_roads = []
         self.paths = []
 
+        # The path for every (incoming road, outgoing road) pair, and the
+        # outgoing roads for every (incoming road, movement) pair. Roads are
+        # given by index.
+        self.od_paths = {}
+        self.routes = {}
+
+        # The paths cars can take, and the table to sample them from.
+        self.demand_paths = []
+        self.demand_table = None
+
     def add_roads(self, roads):
         """Adds roads to the network."""
         for road in roads:
@@ -23,6 +90,8 @@ class Network:
         self.incoming()
         self.outgoing()
         self.find_paths()
+        self.make_routes()
+        self.set_demand(self.default_demand())
 
     def make_connections(self):
         """
@@ -75,8 +144,8 @@ class Network:
         for more comments.
         """
         # Loop over every start and end to get every possible path between them.
-        for start in self.in_roads:
-            for end in self.out_roads:
+        for i, start in enumerate(self.in_roads):
+            for j, end in enumerate(self.out_roads):
 
                 # Set the distance to every road to infinity, except for start.
                 dist = [infty] * len(self.roads)
@@ -122,6 +191,58 @@ class Network:
                         u = prev[self.roads.index(u)]
 
                 self.paths.append(S)
+                if S:
+                    self.od_paths[(i, j)] = S
 
         # Sort the paths by length to make differentiating easier.
         self.paths.sort(key=len)
+
+    def make_routes(self):
+        """
+        Make the table of the outgoing roads for every incoming road and
+        turning movement, like (0, "left"). In a larger network an incoming
+        road can have more than one exit with the same movement.
+        """
+        self.routes = {}
+        for (i, j), path in self.od_paths.items():
+            self.routes.setdefault((i, movement(path)), []).append(j)
+
+    def default_demand(self):
+        """
+        The default demand between every incoming and outgoing road. Every
+        incoming road is equally likely, and the movements are as likely as
+        in MOVEMENT_PROBS. The weight of a movement is split evenly over its
+        exits.
+        """
+        demand = [[0] * len(self.out_roads) for _ in self.in_roads]
+        for (i, move), exits in self.routes.items():
+            for j in exits:
+                demand[i][j] = MOVEMENT_PROBS[move] / len(exits)
+
+        # Make every incoming road equally likely.
+        for row in demand:
+            total = sum(row)
+            for j in range(len(row)):
+                row[j] = row[j] / total if total > 0 else 0
+        return demand
+
+    def set_demand(self, demand):
+        """
+        Set the demand, the weight of every (incoming road, outgoing road)
+        pair. demand[i][j] is the weight of the path from in_roads[i] to
+        out_roads[j]. Pairs without a path are left out. Raises a ValueError
+        if no pair with a path has a positive weight.
+        """
+        self.demand_paths = []
+        weights = []
+        for (i, j), path in self.od_paths.items():
+            if demand[i][j] > 0:
+                self.demand_paths.append(path)
+                weights.append(demand[i][j])
+        if not weights:
+            raise ValueError("The demand has no paths with a positive weight.")
+        self.demand_table = AliasTable(weights)
+
+    def sample_path(self, rng):
+        """Sample a path according to the demand, with a random stream."""
+        return self.demand_paths[self.demand_table.sample(rng)]
@@ -0,0 +1,304 @@
+"""
+This file contains a simulation that is split over multiple processes. The
+roads of the network are partitioned into spatial regions, and the cars on the
+roads of every region are simulated by their own worker process. At the end of
+every step, cars that drove onto a road of another region are handed over to
+that region, and every region receives the cars of the other regions that
+its cars can react to: the cars on the roads next to its own roads.
+"""
+
+from car import Car
+from pollution import BIN_LENGTH
+from simulation import Simulation
+
+import sys
+import time
+from bisect import insort
+from multiprocessing import Pipe, Process
+
+import numpy as np
+
+
+def partition_roads(roads, regions):
+    """
+    Partition the roads into spatial regions by the position of their middle.
+    Returns the region of every road.
+    """
+    middles = [
+        ((r.start[0] + r.end[0]) / 2, (r.start[1] + r.end[1]) / 2) for r in roads
+    ]
+    order = sorted(range(len(roads)), key=lambda i: middles[i])
+
+    # Give every region an (almost) equal number of neighbouring roads.
+    owner = [0] * len(roads)
+    for rank, i in enumerate(order):
+        owner[i] = rank * regions // len(roads)
+    return owner
+
+
+def worker(conn, region, owner, settings):
+    """
+    Simulate the cars on the roads of a single region. Every step, the cars
+    that arrive in the region and the cars in the other regions are received,
+    and the cars in the region and the cars that left it are sent back.
+    """
+    pol_type, save_pol_map, light_duration, fps, roads = settings
+    # Build the same network as the coordinator, from its roads.
+    sim = Simulation(pol_type, save_pol_map, roads=roads)
+    sim.light_duration = light_duration
+    sim.FPS = fps
+    # Only the coordinator spawns new cars.
+    sim.car_gen_prob = 0
+
+    road_index = {id(road): i for i, road in enumerate(sim.roads)}
+    other_roads = [r for i, r in enumerate(sim.roads) if owner[i] != region]
+
+    while True:
+        message, arrivals, ghosts = conn.recv()
+
+        if message == "stop":
+            sim.flush_pollution()
+            # Send the pollution of the region, with the bins per road index.
+            pollution = []
+            for pol_map in sim.pol_maps:
+                road_bins = {
+                    road_index[id(road)]: bins
+                    for road, bins in pol_map.road_bins.values()
+                }
+                pollution.append((pol_map.total_pol, road_bins))
+            conn.send(pollution)
+            return
+
+        # Remove the cars of the other regions from the previous step, and
+        # add the current ones. They are not simulated by this region.
+        for road in other_roads:
+            road.cars = []
+        for state in ghosts:
+            Car.from_state(state, sim.roads)
+
+        # Keep the cars ordered by when they were spawned, like in a
+        # simulation with a single process.
+        for state in arrivals:
+            insort(sim.cars, Car.from_state(state, sim.roads), key=lambda c: c.id)
+
+        sim.simulate()
+
+        # Hand over the cars that drove onto a road of another region.
+        own, handed = [], []
+        for car in list(sim.cars):
+            if owner[road_index[id(car.road)]] == region:
+                own.append(car.state(road_index))
+            else:
+                # The pollution of the car so far belongs to this region.
+                sim.add_car_pollution(car, sim.timer + 1)
+                handed.append(car.state(road_index))
+                sim.cars.remove(car)
+        conn.send((own, handed))
+
+
+class PartitionedSimulation:
+    """
+    A simulation of the traffic at the intersection that is split over a
+    number of regions, which are each simulated by their own process.
+    """
+
+    def __init__(
+        self, regions=2, pol_type="", save_pol_map=True, roads=None, seed=None
+    ) -> None:
+        """
+        Split the roads, which are those of the intersection if not given
+        (see Simulation), into regions. With a seed, the same seed gives the
+        same results as a simulation with a single process.
+        """
+        # This simulation is only used to spawn cars, and to collect the
+        # pollution of all regions at the end.
+        self.sim = Simulation(pol_type, save_pol_map, roads=roads)
+        if seed is not None:
+            self.sim.set_streams(seed)
+        self.pol_type = pol_type
+        self.save_pol_map = save_pol_map
+
+        # The settings that can be changed before the simulation starts.
+        self.FPS = self.sim.FPS
+        self.light_duration = self.sim.light_duration
+        self.car_gen_prob = self.sim.car_gen_prob
+
+        self.regions = regions
+        self.owner = partition_roads(self.sim.roads, regions)
+        self.road_index = {id(road): i for i, road in enumerate(self.sim.roads)}
+
+        # The roads of other regions next to the roads of every region. The
+        # cars of a region look at the roads after their own road, and at the
+        # other roads onto those, to see who has the right of way.
+        self.children = [
+            [self.road_index[id(child)] for child in road.children]
+            for road in self.sim.roads
+        ]
+        self.near = []
+        for region in range(regions):
+            near = set()
+            for i, road in enumerate(self.sim.roads):
+                if self.owner[i] != region:
+                    continue
+                for child in road.children:
+                    near.add(self.road_index[id(child)])
+                    near.update(self.road_index[id(p)] for p in child.parents)
+            self.near.append(
+                {i for i in near if self.owner[i] != region}
+            )
+
+        self.conns = []
+        self.processes = []
+
+        # The cars that arrive in every region at the next step, and the cars
+        # in every region after the last step.
+        self.arrivals = [[] for _ in range(regions)]
+        self.states = [[] for _ in range(regions)]
+
+    @property
+    def num_cars(self):
+        return self.sim.num_cars
+
+    @property
+    def pol_maps(self):
+        return self.sim.pol_maps
+
+    def start(self):
+        """Start a worker process for every region."""
+        self.sim.car_gen_prob = self.car_gen_prob
+        self.sim.start()
+        settings = (
+            self.pol_type,
+            self.save_pol_map,
+            self.light_duration,
+            self.FPS,
+            [(road.start, road.end) for road in self.sim.roads],
+        )
+        for region in range(self.regions):
+            conn, worker_conn = Pipe()
+            process = Process(
+                target=worker, args=(worker_conn, region, self.owner, settings)
+            )
+            process.start()
+            self.conns.append(conn)
+            self.processes.append(process)
+
+    def simulate(self):
+        """Simulate a small step of traffic flow in every region."""
+        if not self.processes:
+            self.start()
+
+        # The cars of all regions by the index of their road.
+        on_road = {}
+        for states in self.states + self.arrivals:
+            for state in states:
+                on_road.setdefault(state[1][state[2]], []).append(state)
+
+        # Every region gets the cars on the roads next to it.
+        for region, conn in enumerate(self.conns):
+            ghosts = [
+                state
+                for i in self.ghost_roads(region, on_road)
+                for state in on_road.get(i, [])
+            ]
+            conn.send(("step", self.arrivals[region], ghosts))
+
+        self.arrivals = [[] for _ in range(self.regions)]
+        for region, conn in enumerate(self.conns):
+            own, handed = conn.recv()
+            self.states[region] = own
+            for state in handed:
+                self.hand_over(state)
+
+        self.spawn_cars()
+
+    def ghost_roads(self, region, on_road):
+        """
+        The roads of other regions with cars that the cars of a region can
+        react to. A car looks past empty roads for the next car on its path,
+        so the children of empty roads are added as well.
+        """
+        roads = set(self.near[region])
+        stack = list(roads)
+        while stack:
+            i = stack.pop()
+            if i in on_road:
+                continue
+            for child in self.children[i]:
+                if self.owner[child] != region and child not in roads:
+                    roads.add(child)
+                    stack.append(child)
+        return roads
+
+    def hand_over(self, state):
+        """Send a car to the region of the road it is on."""
+        region = self.owner[state[1][state[2]]]
+        self.arrivals[region].append(state)
+
+    def spawn_cars(self):
+        """
+        Spawn new random cars in the same way as a simulation with a single
+        process, and send them to the region they start in.
+        """
+        # Only the cars on the incoming roads are needed to see if there is
+        # space to spawn a car.
+        for road in self.sim.network.in_roads:
+            road.cars = []
+        for states in self.states + self.arrivals:
+            for state in states:
+                road = self.sim.roads[state[1][state[2]]]
+                if road in self.sim.network.in_roads:
+                    Car.from_state(state, self.sim.roads)
+
+        # The cars that are due arrive at the end of the step.
+        self.sim.cars = []
+        self.sim.timer += 1
+        self.sim.run_events()
+        for car in self.sim.cars:
+            self.hand_over(car.state(self.road_index))
+
+    def close(self):
+        """
+        Stop the worker processes and add the pollution of every region to
+        the pollution maps.
+        """
+        for conn in self.conns:
+            conn.send(("stop", [], []))
+
+        totals = [0 for _ in self.pol_maps]
+        for conn, process in zip(self.conns, self.processes):
+            for i, (total, road_bins) in enumerate(conn.recv()):
+                totals[i] += total
+                for index, bins in road_bins.items():
+                    distances = (np.arange(len(bins)) + 0.5) * BIN_LENGTH
+                    self.pol_maps[i].add_road_pollution(
+                        self.sim.roads[index], distances, bins
+                    )
+            process.join()
+
+        for pol_map, total in zip(self.pol_maps, totals):
+            pol_map.total_pol = total
+
+        self.conns = []
+        self.processes = []
+
+
+def main():
+    # The number of regions, the number of seconds to simulate and
+    # optionally a seed.
+    regions = int(sys.argv[1])
+    secs = int(sys.argv[2])
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    sim = PartitionedSimulation(regions, "CO2", save_pol_map=False, seed=seed)
+    start = time.time()
+    for _ in range(sim.FPS * secs):
+        sim.simulate()
+    sim.close()
+
+    print(f"Simulated {secs} seconds in {time.time() - start:.1f} seconds")
+    print(f"Cars: {sim.num_cars}, CO2: {sim.pol_maps[0].total_pol:.1f} mg")
+
+
+if __name__ == "__main__":
+    main()
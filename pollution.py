@@ -0,0 +1,265 @@
+"""
+This file contains a class for a pollution map. The pollution is accumulated
+in bins along the roads the cars drive on, and is only turned into a grid of
+the world when the map is drawn. The grid does not depend on the size of the
+screen: its cells have a configurable size in world units, and it is stored
+in tiles that are only allocated where there is pollution.
+"""
+
+import numpy as np
+
+# The length of a pollution bin along a road, in world units (pixels).
+BIN_LENGTH = 1
+
+# The number of cells along each side of a tile of a pollution grid.
+TILE = 64
+
+
+def spread_map(pol_map, spread=15):
+    """
+    Spread the pollution of every cell over the cells around it. The pollution
+    in a cell is added to every cell in a square of the given spread around
+    it, divided by one plus the manhattan distance between the cells.
+    Pollution spread to outside of the map is dropped.
+    """
+    width, height = pol_map.shape
+    new_map = np.zeros(pol_map.shape)
+
+    # Add the whole map at once for every offset in the square.
+    for i in range(-spread + 1, spread):
+        xs_to = slice(max(i, 0), width + min(i, 0))
+        xs_from = slice(max(-i, 0), width - max(i, 0))
+        for j in range(-spread + 1, spread):
+            ys_to = slice(max(j, 0), height + min(j, 0))
+            ys_from = slice(max(-j, 0), height - max(j, 0))
+            new_map[xs_to, ys_to] += pol_map[xs_from, ys_from] / (
+                abs(i) + abs(j) + 1
+            )
+    return new_map
+
+
+def spread_grid(pol_map, origin, cell_size=1, spread=15):
+    """
+    Spread a grid of pollution, with its first cell at origin in the world.
+    The spread is in world units. The grid is first padded by the spread, so
+    no pollution is dropped. Returns the spread grid and its origin.
+    """
+    cells = int(np.ceil(spread / cell_size))
+    padded = np.pad(pol_map, cells)
+    origin = (origin[0] - cells * cell_size, origin[1] - cells * cell_size)
+    return spread_map(padded, cells), origin
+
+
+class TiledGrid:
+    """
+    A grid of square cells over the world. The grid is stored as tiles of
+    TILE by TILE cells, which are only allocated when pollution is added to
+    them, so it can cover a world of any size.
+    """
+
+    def __init__(self, cell_size=1) -> None:
+        """Sets the size of a cell in world units."""
+        self.cell_size = cell_size
+        # The allocated tiles, with the tile coordinates as key.
+        self.tiles = {}
+
+    def add(self, xs, ys, levels):
+        """Add the pollution levels at the world positions xs, ys."""
+        cxs = np.floor(np.asarray(xs) / self.cell_size).astype(int)
+        cys = np.floor(np.asarray(ys) / self.cell_size).astype(int)
+        txs, tys = cxs // TILE, cys // TILE
+
+        # Add the pollution per tile that is hit.
+        keys = np.stack([txs, tys], axis=1)
+        for tx, ty in np.unique(keys, axis=0):
+            inside = (txs == tx) & (tys == ty)
+            key = (int(tx), int(ty))
+            if key not in self.tiles:
+                self.tiles[key] = np.zeros((TILE, TILE))
+            np.add.at(
+                self.tiles[key],
+                (cxs[inside] - tx * TILE, cys[inside] - ty * TILE),
+                np.asarray(levels)[inside],
+            )
+
+    def to_array(self, bounds=None):
+        """
+        Turn the grid into a single array. The array covers the given bounds
+        (xmin, ymin, xmax, ymax) in world units, pollution outside of them is
+        dropped. Without bounds it covers all allocated tiles. Returns the
+        array and the world position of its first cell.
+        """
+        if bounds is not None:
+            x0 = int(np.floor(bounds[0] / self.cell_size))
+            y0 = int(np.floor(bounds[1] / self.cell_size))
+            x1 = max(int(np.ceil(bounds[2] / self.cell_size)), x0 + 1)
+            y1 = max(int(np.ceil(bounds[3] / self.cell_size)), y0 + 1)
+        elif self.tiles:
+            txs, tys = zip(*self.tiles)
+            x0, y0 = min(txs) * TILE, min(tys) * TILE
+            x1, y1 = (max(txs) + 1) * TILE, (max(tys) + 1) * TILE
+        else:
+            x0, y0, x1, y1 = 0, 0, 1, 1
+
+        pol_map = np.zeros((x1 - x0, y1 - y0))
+        for (tx, ty), tile in self.tiles.items():
+            # The part of the tile that overlaps with the array.
+            xa, xb = max(tx * TILE, x0), min((tx + 1) * TILE, x1)
+            ya, yb = max(ty * TILE, y0), min((ty + 1) * TILE, y1)
+            if xa >= xb or ya >= yb:
+                continue
+            pol_map[xa - x0 : xb - x0, ya - y0 : yb - y0] += tile[
+                xa - tx * TILE : xb - tx * TILE, ya - ty * TILE : yb - ty * TILE
+            ]
+        return pol_map, (x0 * self.cell_size, y0 * self.cell_size)
+
+    def total(self):
+        return sum(tile.sum() for tile in self.tiles.values())
+
+    def to_tiles(self):
+        """
+        The allocated tiles as an array of their tile coordinates, of shape
+        (tiles, 2), and an array of the tiles, of shape (tiles, TILE, TILE).
+        """
+        keys = np.array(list(self.tiles), dtype=int).reshape(-1, 2)
+        tiles = np.array(list(self.tiles.values())).reshape(-1, TILE, TILE)
+        return keys, tiles
+
+    @classmethod
+    def from_tiles(cls, keys, tiles, cell_size=1):
+        """Make a grid from the arrays of TiledGrid.to_tiles."""
+        grid = cls(cell_size)
+        for (tx, ty), tile in zip(keys, tiles):
+            grid.tiles[(int(tx), int(ty))] = np.array(tile, dtype=float)
+        return grid
+
+    @classmethod
+    def from_array(cls, pol_map, origin, cell_size=1):
+        """Make a grid from an array with its first cell at origin."""
+        grid = cls(cell_size)
+        cxs, cys = np.nonzero(pol_map)
+        grid.add(
+            origin[0] + (cxs + 0.5) * cell_size,
+            origin[1] + (cys + 0.5) * cell_size,
+            pol_map[cxs, cys],
+        )
+        return grid
+
+
+def draw_grid(ax, grid, spread=15, bounds=None):
+    """
+    Draw a spread tiled grid in world coordinates. Only the area that is
+    drawn is turned into an array: the bounds (xmin, ymin, xmax, ymax) if
+    they are given, and otherwise all of the pollution and its spread.
+    Returns the drawn array.
+    """
+    cells = int(np.ceil(spread / grid.cell_size)) if spread > 0 else 0
+    if bounds is None:
+        pol_map, origin = grid.to_array()
+        if cells > 0:
+            pol_map, origin = spread_grid(
+                pol_map, origin, grid.cell_size, spread
+            )
+    else:
+        # Pollution just outside of the bounds spreads into them.
+        margin = cells * grid.cell_size
+        pol_map, origin = grid.to_array(
+            (
+                bounds[0] - margin,
+                bounds[1] - margin,
+                bounds[2] + margin,
+                bounds[3] + margin,
+            )
+        )
+        if cells > 0:
+            pol_map = spread_map(pol_map, cells)[cells:-cells, cells:-cells]
+            origin = (origin[0] + margin, origin[1] + margin)
+    normed = pol_map / max(pol_map.max(), 1e-12)
+
+    width, height = np.array(pol_map.shape) * grid.cell_size
+    ax.imshow(
+        normed.T,
+        interpolation="none",
+        cmap="hot",
+        vmin=0,
+        extent=(origin[0], origin[0] + width, origin[1] + height, origin[1]),
+    )
+    return pol_map
+
+
+class PollutionMap:
+    """
+    Used to create a map of pollution. Visualize the pollution in the simulation
+    and keep track of the pollution.
+    """
+
+    def __init__(self, pol_type="CO2", cell_size=1) -> None:
+        """Sets the pollution to plot and the size of the cells of its grid."""
+        # The pollution per road, binned along the length of the road. The
+        # key is the id of the road, the value the road and its bins.
+        self.road_bins = {}
+        self.pol_map = None
+        self.total_pol = 0
+        self.pol_type = pol_type
+        self.cell_size = cell_size
+
+    def __bins(self, road):
+        """Get the bins of a road, create them if they do not exist yet."""
+        if id(road) not in self.road_bins:
+            n_bins = max(int(np.ceil(road.length / BIN_LENGTH)), 1)
+            self.road_bins[id(road)] = (road, np.zeros(n_bins))
+        return self.road_bins[id(road)][1]
+
+    def add_pollution(self, road, distance, level, spread=15):
+        """
+        Add pollution to the map at a distance along a road. The pollution is
+        added to the bins of the road and to the total pollution. A spread of 0
+        means that the pollution is added to the total only.
+        """
+        self.total_pol = self.total_pol + level
+        if spread == 0:
+            return
+
+        bins = self.__bins(road)
+        # Pollution past the end of the road is added to the last bin.
+        i = min(max(int(distance / BIN_LENGTH), 0), len(bins) - 1)
+        bins[i] = bins[i] + level
+
+    def add_road_pollution(self, road, distances, levels, spread=15):
+        """
+        Add arrays of pollution levels at the given distances along a road
+        at once. Works the same as calling add_pollution for every level.
+        """
+        self.total_pol = self.total_pol + levels.sum()
+        if spread == 0:
+            return
+
+        bins = self.__bins(road)
+        i = np.clip((distances / BIN_LENGTH).astype(int), 0, len(bins) - 1)
+        np.add.at(bins, i, levels)
+
+    def rasterise(self):
+        """
+        Turn the pollution along the roads into a tiled grid of the world.
+        Every bin is added to the cell its center is in.
+        """
+        grid = TiledGrid(self.cell_size)
+        for road, bins in self.road_bins.values():
+            # The positions of the centers of the bins.
+            centers = (np.arange(len(bins)) + 0.5) / len(bins)
+            xs = road.start[0] + centers * (road.end[0] - road.start[0])
+            ys = road.start[1] + centers * (road.end[1] - road.start[1])
+            grid.add(xs, ys, bins)
+        return grid
+
+    def draw_map(self, ax, spread=15, bounds=None):
+        """
+        Draws a subplot in matplotlib, in world coordinates. The map covers
+        the bounds (xmin, ymin, xmax, ymax) if they are given, and otherwise
+        all of the pollution and its spread.
+        """
+        self.pol_map = draw_grid(ax, self.rasterise(), spread, bounds)
+        ax.set_title(f"{self.pol_type} pollution")
+        ax.set_xlabel("x")
+        ax.set_ylabel("y")
+        ax.axis("off")
@@ -0,0 +1,149 @@
+"""
+This file contains a pipeline to process many saved runs at once. A run is
+either a recording made with recorder.py, or a file of pollution grids made
+with Simulation.save_pol_maps. The runs are processed in parallel, after which
+all figures and tables are written in one batch.
+"""
+
+import os
+import sys
+import numpy as np
+from multiprocessing import Pool
+
+import matplotlib
+
+# Only save the figures, this also makes plotting work in the workers.
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+from pollution import TiledGrid, draw_grid
+from replay import replay_pollution
+
+POL_TYPES = ["CO2", "NO", "HC", "CO"]
+
+
+def run_name(filename):
+    """The name of a run, which is the file name without the extension."""
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def load_grids(filename):
+    """
+    Load the pollution grids of a run. Returns the tiled grid, the total
+    pollution and the pollution per road for every type of pollution.
+    """
+    with np.load(filename) as data:
+        # Grids saved with Simulation.save_pol_maps.
+        if "cars" not in data:
+            # Older grids are a single array, and the oldest ones cover the
+            # screen with cells of a single pixel.
+            cell_size = float(data["cell_size"]) if "cell_size" in data else 1
+            grids = {}
+            for t in POL_TYPES:
+                if t + "_keys" in data:
+                    grids[t] = TiledGrid.from_tiles(
+                        data[t + "_keys"], data[t + "_tiles"], cell_size
+                    )
+                elif t in data:
+                    origin = data.get(t + "_origin", (0, 0))
+                    grids[t] = TiledGrid.from_array(data[t], origin, cell_size)
+            totals = {t: grid.total() for t, grid in grids.items()}
+            return grids, totals, {}
+
+    # A recording, make the pollution maps from the states of the cars.
+    grids, totals, road_totals = {}, {}, {}
+    for pol_map in replay_pollution(filename, POL_TYPES):
+        grids[pol_map.pol_type] = pol_map.rasterise()
+        totals[pol_map.pol_type] = pol_map.total_pol
+        for road, bins in pol_map.road_bins.values():
+            road_totals[(pol_map.pol_type, str(road.start), str(road.end))] = (
+                bins.sum()
+            )
+    return grids, totals, road_totals
+
+
+def process_run(args):
+    """
+    Process a single run: save its spread pollution heatmaps and return its
+    total pollution and pollution per road.
+    """
+    filename, output, spread = args
+    grids, totals, road_totals = load_grids(filename)
+
+    _, axs = plt.subplots(2, 2, figsize=(8, 8))
+    plt.suptitle(f"Pollution heatmap for run {run_name(filename)}")
+    plt.subplots_adjust(wspace=0.02, hspace=0.1)
+    for (pol_type, grid), ax in zip(grids.items(), axs.flatten()):
+        draw_grid(ax, grid, spread)
+        ax.set_title(f"{pol_type} pollution")
+        ax.axis("off")
+    plt.savefig(f"{output}_{run_name(filename)}.png")
+    plt.close()
+
+    return run_name(filename), totals, road_totals
+
+
+def write_tables(results, output):
+    """Write the pollution per road and the summary over the runs."""
+    with open(output + "_roads.csv", "w") as file:
+        file.write("run,pollution,start,end,total\n")
+        for name, _, road_totals in results:
+            for (pol_type, start, end), total in road_totals.items():
+                file.write(f'{name},{pol_type},"{start}","{end}",{total}\n')
+
+    with open(output + "_summary.csv", "w") as file:
+        file.write("pollution,runs,mean,std,min,max\n")
+        for pol_type in POL_TYPES:
+            totals = [t[pol_type] for _, t, _ in results if pol_type in t]
+            if len(totals) == 0:
+                continue
+            file.write(
+                f"{pol_type},{len(totals)},{np.mean(totals)},{np.std(totals)},"
+                f"{np.min(totals)},{np.max(totals)}\n"
+            )
+
+
+def save_image(results, output):
+    """Plot the mean total pollution over the runs for every type."""
+    pol_types = [t for t in POL_TYPES if t in results[0][1]]
+    totals = np.array([[t[p] for p in pol_types] for _, t, _ in results])
+
+    plt.figure(figsize=(10, 7))
+    plt.bar(
+        range(len(pol_types)),
+        np.mean(totals, 0),
+        yerr=np.std(totals, 0),
+        capsize=5,
+    )
+    plt.xticks(range(len(pol_types)), pol_types)
+    plt.title(f"The average total pollution over {len(results)} runs")
+    plt.xlabel("Type of pollution")
+    plt.ylabel("Total emission (mg)")
+    plt.savefig(output + ".png")
+    plt.close()
+
+
+def postprocess(filenames, output, spread=15, processes=None):
+    """Process all runs in a pool of processes and write the results."""
+    with Pool(processes) as pool:
+        results = pool.map(
+            process_run, [(filename, output, spread) for filename in filenames]
+        )
+        # Let the workers stop by themselves, pygame catches the signal
+        # that terminates them.
+        pool.close()
+        pool.join()
+
+    write_tables(results, output)
+    save_image(results, output)
+    return results
+
+
+def main():
+    # The name of the output, followed by the files of the runs.
+    output = sys.argv[1]
+    postprocess(sys.argv[2:], output)
+
+
+if __name__ == "__main__":
+    main()
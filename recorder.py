@@ -0,0 +1,100 @@
+"""
+This file contains a class to record the state of every car in every frame of
+a simulation. The states are stored in chunks of numpy structured arrays and
+saved together in a single .npz file, which can be replayed with replay.py.
+"""
+
+import numpy as np
+
+# The state of a single car in a single frame.
+CAR_STATE = np.dtype(
+    [
+        ("frame", np.int32),
+        ("id", np.int32),
+        ("road", np.int16),
+        ("progress", np.float32),
+        ("v", np.float32),
+        ("a", np.float32),
+    ]
+)
+
+# The number of car states in one chunk.
+CHUNK_SIZE = 2**16
+
+# The number of frames of light states in one chunk.
+LIGHT_CHUNK_SIZE = 2**12
+
+
+class Recorder:
+    """Record the state of the cars and traffic lights of a simulation."""
+
+    def __init__(self, filename, roads) -> None:
+        """Sets the file to save to and the roads of the simulation."""
+        self.filename = filename
+        self.roads = roads
+        self.road_index = {id(road): i for i, road in enumerate(roads)}
+
+        # The full chunks, and the chunk that is currently being filled.
+        self.chunks = []
+        self.chunk = np.empty(CHUNK_SIZE, dtype=CAR_STATE)
+        self.n = 0
+
+        # Which roads are green, for every frame, in chunks like the cars.
+        self.light_chunks = []
+        self.light_chunk = np.empty((LIGHT_CHUNK_SIZE, len(roads)), dtype=bool)
+        self.n_lights = 0
+
+    def record_lights(self):
+        """Record which roads are green in this frame."""
+        if self.n_lights == LIGHT_CHUNK_SIZE:
+            self.light_chunks.append(self.light_chunk)
+            self.light_chunk = np.empty(
+                (LIGHT_CHUNK_SIZE, len(self.roads)), dtype=bool
+            )
+            self.n_lights = 0
+
+        for i, road in enumerate(self.roads):
+            self.light_chunk[self.n_lights, i] = road.green
+        self.n_lights += 1
+
+    def record_car(self, frame, car):
+        """Record the state of a car in this frame."""
+        # Start a new chunk if the current one is full.
+        if self.n == CHUNK_SIZE:
+            self.chunks.append(self.chunk)
+            self.chunk = np.empty(CHUNK_SIZE, dtype=CAR_STATE)
+            self.n = 0
+
+        self.chunk[self.n] = (
+            frame,
+            car.id,
+            self.road_index[id(car.road)],
+            car.progress,
+            car.v,
+            car.a,
+        )
+        self.n += 1
+
+    def save(self, fps):
+        """Save the recording to the file."""
+        roads = [list(road.start) + list(road.end) for road in self.roads]
+        np.savez(
+            self.filename,
+            cars=np.concatenate(self.chunks + [self.chunk[: self.n]]),
+            lights=np.concatenate(
+                self.light_chunks + [self.light_chunk[: self.n_lights]]
+            ),
+            roads=np.array(roads, dtype=float),
+            fps=fps,
+        )
+
+
+def load(filename):
+    """Load a recording, returns the car states, lights, roads and FPS."""
+    with np.load(filename) as data:
+        return (
+            data["cars"],
+            data["lights"],
+            data["roads"],
+            int(data["fps"]),
+        )
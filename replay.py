@@ -0,0 +1,116 @@
+"""
+This file contains functions to replay a simulation recorded with recorder.py.
+The recorded cars and traffic lights are drawn with pygame, and the pollution
+maps are made from the recording without simulating the traffic again.
+"""
+
+from road import Road
+from car import EM_TYPES
+from recorder import load
+from pollution import PollutionMap
+
+import sys
+import numpy as np
+from dataclasses import dataclass
+
+
+@dataclass
+class ReplayCar:
+    """The part of a car that is needed to draw it."""
+
+    pos: list
+    dir: float
+    color: tuple
+
+
+def emission_rates(v, a, pol_type="CO2"):
+    """
+    Get the pollution per second for arrays of speeds and accelerations.
+    This is the same as Car.cur_pollution, but for many cars at once.
+    """
+    em = EM_TYPES[pol_type]
+    return np.select(
+        [v < 10, a > 0.1, a < 0.1],
+        [em.idle, em.accel, em.decel],
+        em.cruise,
+    )
+
+
+def replay_pollution(filename, pol_types=("CO2", "NO", "HC", "CO"), spread=15):
+    """
+    Make the pollution maps of a recorded simulation. Returns a pollution map
+    for every type of pollution.
+    """
+    cars, _, road_coords, fps = load(filename)
+    roads = [Road(list(r[:2]), list(r[2:])) for r in road_coords]
+
+    pol_maps = [PollutionMap(pol_type) for pol_type in pol_types]
+
+    # Sort the states by road, so every road can be added at once.
+    cars = cars[np.argsort(cars["road"], kind="stable")]
+    bounds = np.searchsorted(cars["road"], np.arange(len(roads) + 1))
+
+    for i, road in enumerate(roads):
+        states = cars[bounds[i] : bounds[i + 1]]
+        if len(states) == 0:
+            continue
+
+        distances = states["progress"].astype(float) * road.length
+        for pol_map in pol_maps:
+            levels = emission_rates(states["v"], states["a"], pol_map.pol_type)
+            pol_map.add_road_pollution(road, distances, levels / fps, spread)
+
+    return pol_maps
+
+
+def replay(filename):
+    """Draw a recorded simulation frame by frame, without simulating it."""
+    # Only import the simulation here, since it opens the pygame screen.
+    from simulation import Simulation, pygame, YELLOW
+
+    cars, lights, _, _ = load(filename)
+    sim = Simulation()
+
+    # The first state of every frame, and the end of the last frame. A
+    # recording without frames has no states.
+    bounds = np.searchsorted(cars["frame"], np.arange(1, len(lights) + 2))
+
+    for i in range(len(lights)):
+        for road, green in zip(sim.roads, lights[i]):
+            road.green = green
+
+        sim.cars = []
+        for state in cars[bounds[i] : bounds[i + 1]]:
+            road = sim.roads[state["road"]]
+            distance = state["progress"] * road.length
+            pos = [
+                road.start[0] + np.cos(road.angle) * distance,
+                road.start[1] - np.sin(road.angle) * distance,
+            ]
+            sim.cars.append(ReplayCar(pos, road.angle, YELLOW))
+
+        sim.draw()
+
+        # Stop the replay when the window is closed.
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return
+
+
+def main():
+    filename = sys.argv[1]
+    replay(filename)
+
+    # Make the pollution map from the recording.
+    import matplotlib.pyplot as plt
+
+    _, axs = plt.subplots(2, 2, figsize=(8, 8))
+    plt.suptitle("Pollution heatmap for differnet pollution types")
+    plt.subplots_adjust(wspace=0.02, hspace=0.1)
+    for pol_map, ax in zip(replay_pollution(filename), axs.flatten()):
+        pol_map.draw_map(ax)
+    plt.savefig("pollution.png")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,11 +19,23 @@ class Road:
         self.cars = []
 
         self.length = dist(start, end)
+        self.set_unit()
         deltaX = end[0] - start[0]
         deltaY = end[1] - start[1]
         # in pygame, y is going down, so invert the angle
         self.angle = -np.arctan2(deltaY, deltaX)
 
+    def set_unit(self):
+        """
+        Set the unit vector along the road, so the position at a distance
+        along the road is start + distance * unit.
+        """
+        length = self.length if self.length > 0 else 1
+        self.unit = [
+            (self.end[0] - self.start[0]) / length,
+            (self.end[1] - self.start[1]) / length,
+        ]
+
     def intersects(self, other):
         """
         Check if the road intersects with the other road.
@@ -67,6 +79,7 @@ class Road:
         old_end = self.end
         self.end = point
         self.length = dist(self.start, self.end)
+        self.set_unit()
         return Road(point, old_end)
 
     def full(self):
@@ -75,7 +88,7 @@ class Road:
         for car in self.cars:
             # If there is a car at the start and it is slower than speed,
             # the road is full.
-            if dist(car.pos, self.start) <= 40:
+            if car.s <= 40:
                 return True
         else:
             return False
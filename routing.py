@@ -0,0 +1,176 @@
+"""
+This file contains congestion aware routing. The cost of a road is the time
+it currently takes to drive over it, which follows from the speeds of the
+cars on it. For every outgoing road a tree of the fastest paths to it is kept,
+so a car can pick the fastest next road at every junction. When the costs
+change, the trees are repaired incrementally instead of being recomputed:
+only the roads whose fastest path got slower are reset, and only the roads
+whose distance changes are visited.
+"""
+
+import heapq
+from math import inf
+
+# The speed of a car on an empty road, in pixels per second. This is the
+# average of the maximum speeds of the cars.
+FREE_SPEED = 55.5
+
+# The lowest speed used for the cost of a road, so a road with only stopped
+# cars gets a high but finite cost.
+MIN_SPEED = 1
+
+# Costs that change less than this fraction are not updated.
+TOLERANCE = 0.05
+
+
+class ShortestPathTree:
+    """
+    The fastest paths from every road to a destination road. dist[i] is the
+    time to drive from the start of road i to the end of the destination, and
+    next[i] is the index of the road to take after road i.
+    """
+
+    def __init__(self, network, dest, costs) -> None:
+        """Make the tree to the road with index dest for the given costs."""
+        self.network = network
+        self.index = {id(road): i for i, road in enumerate(network.roads)}
+        self.dest = dest
+        self.costs = list(costs)
+
+        n = len(network.roads)
+        self.dist = [inf] * n
+        self.next = [None] * n
+
+        self.dist[dest] = self.costs[dest]
+        self.relax([(self.dist[dest], dest)])
+
+    def relax(self, heap):
+        """
+        Dijkstra's algorithm backwards from the roads in the heap, which is a
+        list of (distance, road index). The distance of a parent is lowered
+        when the road is a faster way to the destination.
+        """
+        heapq.heapify(heap)
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d > self.dist[i]:
+                continue
+            for parent in self.network.roads[i].parents:
+                p = self.index[id(parent)]
+                alt = self.costs[p] + d
+                if alt < self.dist[p]:
+                    self.dist[p] = alt
+                    self.next[p] = i
+                    heapq.heappush(heap, (alt, p))
+
+    def subtree(self, roots):
+        """The roads whose fastest path goes over one of the roots."""
+        children = [[] for _ in self.dist]
+        for i, j in enumerate(self.next):
+            if j is not None:
+                children[j].append(i)
+
+        found = set()
+        stack = [i for i in roots if self.dist[i] < inf]
+        while stack:
+            i = stack.pop()
+            if i in found:
+                continue
+            found.add(i)
+            stack.extend(children[i])
+        return found
+
+    def update(self, changes):
+        """
+        Change the costs of some roads, given as {road index: cost}, and
+        repair the tree.
+        """
+        increased = [i for i, c in changes.items() if c > self.costs[i]]
+        for i, cost in changes.items():
+            self.costs[i] = cost
+
+        # The fastest paths over a road that got slower may not be the
+        # fastest any more, so their roads are reset.
+        affected = self.subtree(increased)
+        for i in affected:
+            self.dist[i] = inf
+            self.next[i] = None
+
+        heap = []
+        # The reset roads start from the best of their children that still
+        # have a valid distance.
+        for i in affected:
+            if i == self.dest:
+                self.dist[i] = self.costs[i]
+            for child in self.network.roads[i].children:
+                c = self.index[id(child)]
+                alt = self.costs[i] + self.dist[c]
+                if c not in affected and alt < self.dist[i]:
+                    self.dist[i] = alt
+                    self.next[i] = c
+            if self.dist[i] < inf:
+                heap.append((self.dist[i], i))
+
+        # Roads that got faster only lower the distances.
+        for i, cost in changes.items():
+            if i in affected or self.dist[i] == inf:
+                continue
+            if i == self.dest:
+                self.dist[i] = cost
+            else:
+                self.dist[i] = cost + self.dist[self.next[i]]
+            heap.append((self.dist[i], i))
+
+        self.relax(heap)
+
+
+class Router:
+    """Route cars over the fastest paths, given the current traffic."""
+
+    def __init__(self, network) -> None:
+        """Make a tree of fastest paths to every outgoing road."""
+        self.network = network
+        self.index = {id(road): i for i, road in enumerate(network.roads)}
+        self.costs = [road.length / FREE_SPEED for road in network.roads]
+        self.trees = {
+            self.index[id(road)]: ShortestPathTree(
+                network, self.index[id(road)], self.costs
+            )
+            for road in network.out_roads
+        }
+
+    def road_cost(self, road):
+        """The time it takes to drive over a road at the current speeds."""
+        if not road.cars:
+            return road.length / FREE_SPEED
+        speed = sum(car.v for car in road.cars) / len(road.cars)
+        return road.length / max(speed, MIN_SPEED)
+
+    def update(self):
+        """Update the costs of the roads and repair the trees."""
+        changes = {}
+        for i, road in enumerate(self.network.roads):
+            cost = self.road_cost(road)
+            if abs(cost - self.costs[i]) > TOLERANCE * self.costs[i]:
+                changes[i] = cost
+                self.costs[i] = cost
+
+        if changes:
+            for tree in self.trees.values():
+                tree.update(changes)
+
+    def route(self, road, dest):
+        """
+        The fastest path from road to the road dest, starting with road.
+        Returns None if dest can not be reached.
+        """
+        tree = self.trees[self.index[id(dest)]]
+        i = self.index[id(road)]
+        if tree.dist[i] == inf:
+            return None
+
+        path = [road]
+        while i != tree.dest:
+            i = tree.next[i]
+            path.append(self.network.roads[i])
+        return path
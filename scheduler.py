@@ -0,0 +1,51 @@
+"""
+This file contains a scheduler for the events of a simulation, like switching
+traffic lights and the arrivals of cars. The events are kept in a heap ordered
+by the frame they happen at, so the simulation loop only has to look at the
+first event every step instead of checking every kind of event every frame.
+"""
+
+import heapq
+
+# The order of events that happen at the same frame.
+ARRIVAL = 0
+SIGNAL = 1
+METRICS = 2
+
+
+class Scheduler:
+    """A priority queue of timed events."""
+
+    def __init__(self) -> None:
+        # The events as (frame, priority, number, tag, callback). The number
+        # keeps events with the same frame and priority in order of adding.
+        self.heap = []
+        self.count = 0
+
+    def schedule(self, frame, callback, priority=SIGNAL, tag=None):
+        """
+        Call callback(frame) at the given frame. The tag can be used to
+        cancel the event.
+        """
+        heapq.heappush(self.heap, (frame, priority, self.count, tag, callback))
+        self.count += 1
+
+    def repeat(self, frame, period, callback, priority=SIGNAL, tag=None):
+        """Call callback(frame) at the given frame and every period after."""
+
+        def event(now):
+            callback(now)
+            self.schedule(now + period, event, priority, tag)
+
+        self.schedule(frame, event, priority, tag)
+
+    def cancel(self, tag):
+        """Remove all events with the given tag."""
+        self.heap = [event for event in self.heap if event[3] != tag]
+        heapq.heapify(self.heap)
+
+    def run(self, frame):
+        """Run all events up to and including the given frame, in order."""
+        while self.heap and self.heap[0][0] <= frame:
+            event_frame, _, _, _, callback = heapq.heappop(self.heap)
+            callback(event_frame)
@@ -0,0 +1,63 @@
+"""
+This file contains signal plans for traffic lights. A plan is a cycle of
+changes, where every change turns the lights of some roads green or red at a
+fixed frame of the cycle. Every intersection can have its own plan.
+"""
+
+from scheduler import SIGNAL
+
+
+class SignalPlan:
+    """A cycle of changes of the traffic lights of an intersection."""
+
+    def __init__(self, cycle, changes) -> None:
+        """
+        Sets the length of the cycle in frames, and the changes as a list
+        of (frame of the cycle, roads, green).
+        """
+        self.cycle = cycle
+        self.changes = changes
+
+    def start(self, scheduler, frame, tag="signal", on_switch=None):
+        """
+        Schedule the changes of the plan, with the cycle starting at frame.
+        If given, on_switch(roads, green) is called after every change.
+        """
+        for offset, roads, green in self.changes:
+            scheduler.repeat(
+                frame + offset,
+                self.cycle,
+                lambda _, roads=roads, green=green: self.switch(
+                    roads, green, on_switch
+                ),
+                SIGNAL,
+                tag,
+            )
+
+    def switch(self, roads, green, on_switch=None):
+        """Turn the lights of the roads green or red."""
+        for road in roads:
+            road.green = green
+        if on_switch:
+            on_switch(roads, green)
+
+
+def two_phase_plan(roads, duration, clearance):
+    """
+    The plan of an intersection with four incoming roads, where the first
+    two and the last two roads get green in turn for duration frames. The
+    roads that have green are turned red clearance frames before the other
+    roads get green. If the duration is not longer than the clearance the
+    lights are never turned red, like in the original simulation.
+    """
+    pairs = [roads[0:2], roads[2:4]]
+    changes = [(0, pairs[0], True), (duration, pairs[1], True)]
+
+    # The first frame of the cycle at which the lights are turned red.
+    red = -clearance % duration
+    if red != 0:
+        for offset in [red, red + duration]:
+            # The pair that gets green next, the other pair is turned red.
+            next = ((offset + clearance) // duration) % 2
+            changes.append((offset, pairs[1 - next], False))
+    return SignalPlan(2 * duration, changes)
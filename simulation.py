@@ -1,13 +1,20 @@
 from road import Road
-from car import Car
+from car import Car, EM_TYPES, driving_state
 from network import Network
+from pollution import PollutionMap, BIN_LENGTH
+from recorder import Recorder
+from routing import Router
+from meso import QueueRoad
+from kpi import KPICollector
+from scheduler import Scheduler, ARRIVAL
+from signals import two_phase_plan
+from streams import make_streams
 
 import matplotlib.pyplot as plt
+import math
 import sys
 import pygame
-from random import random, randint, uniform
 import numpy as np
-from numpy.random import choice
 
 pygame.init()
 
@@ -19,7 +26,7 @@ WHITE = (255, 255, 255)
 GRAY = (128, 128, 128)
 YELLOW = (255, 255, 0)
 
-# Size and width of the pygame screen.
+# Size of the pygame screen, in pixels. The world is scaled to fit it.
 SIZE = WIDTH, HEIGHT = 500, 500
 screen = pygame.display.set_mode(SIZE)
 
@@ -29,74 +36,22 @@ C_LENGTH = 16
 MIN_DIST = 40
 
 
-class PollutionMap:
-    """
-    Used to create a map of pollution. Visualize the pollution in the simulation
-    and keep track of the pollution.
-    """
-
-    def __init__(self, pol_type="CO2") -> None:
-        """Sets the pollution to plot."""
-        self.pol_map = np.zeros(SIZE)
-        self.total_pol = 0
-        self.pol_type = pol_type
-
-    def __try_add(self, x, y, level):
-        """
-        Check if the position is within the map.
-        If it is, it add the pollution to the map and to the total pollution.
-        """
-        x, y = int(x), int(y)
-        if x < 0 or x >= WIDTH or y < 0 or y >= HEIGHT:
-            return
-        self.pol_map[x, y] = self.pol_map[x, y] + level
-        self.total_pol = self.total_pol + level
-
-    def add_pollution(self, x, y, level, spread=15):
-        """
-        Add pollution to the map. Spread the pollution over a certain area.
-        The spread is a number of pixels. The pollution is added to the map
-        and to the total pollution. A spread of 0 means that the pollution
-        is added to the total only.
-        """
-        if spread == 0:
-            self.total_pol = self.total_pol + level
-            return
-        self.__try_add(x, y, level)
-
-    def __spread_map(self, spread=15):
-        old_map = self.pol_map.copy()
-        new_map = np.zeros(SIZE)
-        self.pol_map = new_map
-
-        for x in range(WIDTH):
-            for y in range(HEIGHT):
-                if old_map[x, y] > 0:
-                    for i in range(-spread + 1, spread):
-                        for j in range(-spread + 1, spread):
-                            self.__try_add(
-                                round(x + i),
-                                round(y + j),
-                                old_map[x, y] / (abs(i) + abs(j) + 1),
-                            )
-
-    def draw_map(self, ax, spread=15):
-        """Draws a subplot in matplotlib."""
-        if spread > 0:
-            self.__spread_map(spread)
-            normed = self.pol_map / self.pol_map.max()
-
-        ax.imshow(normed.T, interpolation="none", cmap="hot", vmin=0)
-        ax.set_title(f"{self.pol_type} pollution")
-        ax.set_xlabel("x")
-        ax.set_ylabel("y")
-        ax.axis("off")
-
-
 class Simulation:
     """Define a simulation of the traffic at the intersection."""
 
-    def __init__(self, pol_type="", save_pol_map=True) -> None:
+    def __init__(
+        self,
+        pol_type="",
+        save_pol_map=True,
+        record=None,
+        cell_size=1,
+        roads=None,
+    ) -> None:
+        """
+        Make the simulation. Without roads, the roads of the intersection are
+        made. Otherwise roads is a list of (start, end) points of roads that
+        do not cross each other, like the roads of another simulation.
+        """
         # The number of simulation frames per second.
         self.FPS = 30
         # The length of one simulation step.
@@ -106,33 +61,117 @@ class Simulation:
         self.network = Network()
         self.timer = 0
         self.light_duration = 2
+        # The frame at which the current light duration started.
+        self.light_start = 0
         self.car_gen_prob = 10/9
         self.num_cars = 0
 
         # Create the roads.
-        self.create_roads()
+        if roads is None:
+            self.create_roads()
+        else:
+            self.roads = [Road(list(start), list(end)) for start, end in roads]
 
         # Add them to the network.
         self.network.add_roads(self.roads)
         self.network.calibrate()
 
+        # The part of the world the roads are in, as (xmin, ymin, xmax, ymax)
+        # in world units. It is scaled to fit the screen when drawing.
+        xs = [p[0] for road in self.roads for p in (road.start, road.end)]
+        ys = [p[1] for road in self.roads for p in (road.start, road.end)]
+        self.world = (min(xs), min(ys), max(xs), max(ys))
+        self.scale = min(
+            WIDTH / max(self.world[2] - self.world[0], 1),
+            HEIGHT / max(self.world[3] - self.world[1], 1),
+        )
+
         # Start the traffic lights.
         self.set_trafficlights()
 
+        # Collect the traffic KPIs while the simulation runs.
+        self.kpi = KPICollector(self)
+
         # Prepare parameters for the polution.
         self.pol_type = pol_type
+        # The size of a cell of the pollution grids, in world units.
+        self.cell_size = cell_size
         if len(pol_type) > 0:
-            self.pol_maps = [PollutionMap(pol_type)]
+            self.pol_maps = [PollutionMap(pol_type, cell_size)]
         else:
             self.pol_maps = [
-                PollutionMap("CO2"),
-                PollutionMap("NO"),
-                PollutionMap("HC"),
-                PollutionMap("CO"),
+                PollutionMap("CO2", cell_size),
+                PollutionMap("NO", cell_size),
+                PollutionMap("HC", cell_size),
+                PollutionMap("CO", cell_size),
             ]
 
         self.pol_spread = 15 if save_pol_map else 0
 
+        # The events of the simulation: switching the traffic lights and the
+        # arrivals of cars. They are scheduled when the simulation starts.
+        self.scheduler = Scheduler()
+        self.started = False
+        # The signal plan of every intersection. Without plans, a two phase
+        # plan with the light duration is used.
+        self.signal_plans = None
+
+        # Let cars that stopped right before a red light sleep until the
+        # light turns green. This does not change the simulation, it only
+        # skips cars that would not move.
+        self.sleeping = True
+
+        # The roads that use the mesoscopic model, by the id of the road.
+        self.meso = {}
+
+        # Congestion aware rerouting, off by default. The costs of the roads
+        # are updated every reroute_interval seconds.
+        self.router = None
+        self.reroute_interval = 1
+
+        # The random streams for the arrivals, routes and speeds of cars.
+        self.streams = make_streams()
+
+        # Record the state of every car if a file to record to is given.
+        self.recorder = Recorder(record, self.roads) if record else None
+
+    def set_streams(self, seed, antithetic=False):
+        """
+        Give every source of randomness its own stream with the given seed.
+        Simulations with the same seed use the same random numbers, also
+        when their inputs are different.
+        """
+        self.streams = make_streams(seed, antithetic)
+
+    def enable_rerouting(self, interval=1):
+        """
+        Let cars take the fastest way to the end of their path at every
+        junction, given the speeds of the cars on the roads. The costs of the
+        roads are updated every interval seconds.
+        """
+        self.router = Router(self.network)
+        self.reroute_interval = interval
+        for car in self.cars:
+            car.router = self.router
+
+    def set_mesoscopic(self, roads=None):
+        """
+        Use the mesoscopic model for the given roads, by default the
+        outgoing roads. The cars on these roads are only kept as a queue,
+        see meso.py. Roads with traffic lights are always simulated car by
+        car.
+        """
+        if roads is None:
+            roads = self.network.out_roads
+        for road in roads:
+            if road in self.network.in_roads:
+                raise ValueError("Roads with traffic lights can not be queues.")
+            self.meso[id(road)] = QueueRoad(road, self.FPS)
+
+    def active_cars(self):
+        """The number of cars in the network, also the ones in queues."""
+        return len(self.cars) + sum(len(queue) for queue in self.meso.values())
+
     def create_roads(self) -> None:
         """Generate roads for the simulation."""
         self.create_road([500, 215], [0, 215])
@@ -185,75 +224,239 @@ class Simulation:
         """
 
         if random:
-            speed = uniform(50, 61)
-            # Index 0 for right, 1 for straight, 2 for left, 3 for U-turn.
-            # Also defines the likelyhood. In this case, 10% U-turn,
-            # 30% for the rest.
-            index = choice([0, 1, 2, 3], p=[0.3, 0.3, 0.3, 0.1])
-
-            # Choose a path according to the type.
-            # Since the paths are ordened by length, we can use 0 for right,
-            # which is the shortest path, etc.
-            path = self.network.paths[randint(0, 3) + 4 * index]
+            speed = self.streams["speed"].uniform(50, 61)
+            # Choose a path according to the demand of the network.
+            path = self.network.sample_path(self.streams["route"])
 
         # Only spawn the car if there is space to do so.
         if path[0].full():
             return 1
 
-        self.cars.append(Car(speed, path, color))
+        car = Car(speed, path, color, self.num_cars)
+        car.router = self.router
+        self.kpi.start(car)
+        self.cars.append(car)
         self.num_cars += 1
         return 0
 
     def simulate(self) -> None:
         """Simulate a small step of traffic flow."""
 
-        self.switch_trafficlights()
+        # Switch the lights and spawn the cars that are due.
+        self.run_events()
 
         self.timer += 1
 
-        # Update every car.
-        for car in self.cars:
+        # Update the costs of the roads for rerouting.
+        interval = max(int(self.reroute_interval * self.FPS), 1)
+        if self.router and self.timer % interval == 0:
+            self.router.update()
+
+        if self.recorder:
+            self.recorder.record_lights()
+
+        # Update every car. Loop over a copy, since finished cars are removed.
+        for car in list(self.cars):
+            # Dormant cars do not move, and stay in the same driving state.
+            if car.dormant:
+                if self.recorder:
+                    self.recorder.record_car(self.timer, car)
+                continue
+
             car.change_speed(self.dt, self.network.in_roads)
             # Move the car and check if the path is complete.
             done = car.move(self.dt)
+            if self.recorder:
+                self.recorder.record_car(self.timer, car)
             # Update the pollution.
-            if len(self.pol_type) > 1:
-                self.pol_maps[0].add_pollution(
-                    *car.gen_pollution(self.dt, self.pol_type), self.pol_spread
-                )
-            else:
-                for i in range(4):
-                    pol_type = ["CO2", "NO", "HC", "CO"][i]
-                    self.pol_maps[i].add_pollution(
-                        *car.gen_pollution(self.dt, pol_type), self.pol_spread
-                    )
+            self.account_pollution(car, done)
             # Delete cars if their path is complete.
             if done:
+                if car.kpi:
+                    car.kpi.finish(car)
                 self.cars.remove(car)
                 del car
+                continue
+
+            if car.kpi:
+                car.kpi.update(car)
+            if self.sleeping and car.should_sleep():
+                car.sleep()
+            elif id(car.road) in self.meso:
+                # Hand the car over to the queue of its new road.
+                self.add_car_pollution(car, self.timer + 1)
+                car.road.cars.remove(car)
+                self.cars.remove(car)
+                self.meso[id(car.road)].enter(car, self.timer + 1)
+
+        # Let the cars that are due leave the queues. The queued cars are
+        # recorded where they would be on the road.
+        for queue in self.meso.values():
+            if self.recorder:
+                for car in queue.update(self.timer):
+                    self.recorder.record_car(self.timer, car)
+            for car in queue.step(self):
+                if car.kpi:
+                    car.kpi.finish(car)
+
+    def account_pollution(self, car, done=False):
+        """
+        Keep track of the pollution of a car. The pollution of a car only
+        depends on its driving state, so it is only added to the pollution
+        maps when the state changes, when the car moves to another bin of the
+        maps, or when it leaves.
+        """
+        state = driving_state(car.v, car.a)
+
+        # Where the car is only matters if the pollution is put on the map.
+        where = None
+        if self.pol_spread:
+            distance = car.s
+            where = (id(car.road), int(distance / BIN_LENGTH))
+
+        if state != car.em_state or where != car.em_where:
+            self.add_car_pollution(car, self.timer)
+            car.em_state = state
+            car.em_where = where
+            car.em_road = car.road
+            car.em_distance = car.s
+            car.em_since = self.timer
+
+        if done:
+            self.add_car_pollution(car, self.timer + 1)
+
+    def add_car_pollution(self, car, until):
+        """
+        Add the pollution of a car in its current driving state, from frame
+        em_since up to (but not including) frame until.
+        """
+        if car.em_state is None:
+            return
+
+        frames = until - car.em_since
+        for pol_map in self.pol_maps:
+            rate = getattr(EM_TYPES[pol_map.pol_type], car.em_state)
+            pol_map.add_pollution(
+                car.em_road,
+                car.em_distance,
+                rate * frames * self.dt,
+                self.pol_spread,
+            )
+        car.em_since = until
+
+    def flush_pollution(self):
+        """
+        Add the pollution of every car up to and including the current frame
+        to the pollution maps. Needed before the maps are used.
+        """
+        for car in self.cars:
+            self.add_car_pollution(car, self.timer + 1)
+        for queue in self.meso.values():
+            queue.flush(self, self.timer + 1)
+
+    def start(self):
+        """
+        Schedule the first events. This is done at the first step, so the
+        settings can be changed after the simulation is made.
+        """
+        self.started = True
+        self.start_signals()
+        self.schedule_arrival(self.timer)
 
-        # Spawn new random cars.
-        if random() < self.car_gen_prob / 100:
-            self.create_car(random=True)
+    def run_events(self):
+        """Run the events that are due at the current frame."""
+        if not self.started:
+            self.start()
+        self.scheduler.run(self.timer)
 
-    def switch_trafficlights(self):
+    def start_signals(self):
         """
-        Switch between turning the horizontal or the vertical traffic
-        lights green every n = light_duration number of seconds. There
-        is a small buffer, such that 4 seconds before turning the next
-        set green, the previous one are turned red.
+        Start the signal plans of the intersections at light_start. Without
+        signal plans, the horizontal and the vertical traffic lights are
+        turned green in turn every light_duration seconds, and the lights
+        that are green are turned red 4 seconds before the others get green.
         """
+        self.scheduler.cancel("signal")
+        plans = self.signal_plans or [
+            two_phase_plan(
+                self.network.in_roads,
+                int(self.FPS * self.light_duration),
+                4 * self.FPS,
+            )
+        ]
+        for plan in plans:
+            plan.start(
+                self.scheduler, self.light_start, "signal", self.lights_switched
+            )
+
+    def lights_switched(self, roads, green):
+        """Wake the dormant cars on roads that get green."""
+        if green:
+            for road in roads:
+                for car in road.cars:
+                    if car.dormant:
+                        car.wake()
+
+    def set_signal_plans(self, plans):
+        """Use a signal plan for every intersection, starting now."""
+        self.signal_plans = plans
+        self.light_start = self.timer
+        if self.started:
+            self.start_signals()
+
+    def schedule_arrival(self, frame):
+        """
+        Schedule the arrival of the next random car after frame. A car
+        arrives at every frame with a probability of car_gen_prob percent, so
+        the number of frames until the next arrival is geometric and can be
+        sampled at once.
+        """
+        p = self.car_gen_prob / 100
+        if p <= 0:
+            return
+        gap = 1
+        if p < 1:
+            u = min(self.streams["arrival"].random(), 1 - 1e-16)
+            gap = int(math.log1p(-u) / math.log1p(-p)) + 1
+        self.scheduler.schedule(frame + gap, self.arrive, ARRIVAL, "arrival")
+
+    def arrive(self, frame):
+        """Spawn a random car and schedule the next one."""
+        self.create_car(random=True)
+        self.schedule_arrival(frame)
+
+    def set_car_gen_prob(self, prob):
+        """Change the probability of a new car every frame, starting now."""
+        if self.started:
+            # The arrivals that are due still happen with the old probability.
+            self.scheduler.run(self.timer)
+            self.scheduler.cancel("arrival")
+        self.car_gen_prob = prob
+        if self.started:
+            self.schedule_arrival(self.timer)
+
+    def cycle_ended(self):
+        """Check if a full cycle of the traffic lights has just ended."""
         dur = int(self.FPS * self.light_duration)
-        if (self.timer % dur) == 0:
-            next = 2 * ((self.timer // dur) % 2)
-
-            self.network.in_roads[next].green = True
-            self.network.in_roads[next + 1].green = True
-        elif ((self.timer + (4 * self.FPS)) % dur) == 0:
-            next = 2 * (((self.timer + (4 * self.FPS)) // dur) % 2)
+        return (self.timer - self.light_start) % (2 * dur) == 0
 
-            self.network.in_roads[(next - 2) % 4].green = False
-            self.network.in_roads[(next - 1) % 4].green = False
+    def set_light_duration(self, duration):
+        """
+        Change the light duration while the simulation is running. This
+        should be done when a cycle of the traffic lights has ended, so the
+        new cycle starts with the same lights as the first one.
+        """
+        self.light_duration = duration
+        self.light_start = self.timer
+        if self.started:
+            self.start_signals()
+
+    def to_screen(self, point):
+        """Convert a point in the world to a point on the screen."""
+        return [
+            (point[0] - self.world[0]) * self.scale,
+            (point[1] - self.world[1]) * self.scale,
+        ]
 
     def draw(self):
         """Draw the cars and the roads to the screen."""
@@ -283,7 +486,8 @@ class Simulation:
             p4 = [x + y for x, y in zip(road.end, offset)]
 
             # Draw the road polygon.
-            pygame.draw.polygon(screen, GRAY, [p1, p2, p3, p4])
+            corners = [self.to_screen(p) for p in [p1, p2, p3, p4]]
+            pygame.draw.polygon(screen, GRAY, corners)
 
             # Draw arrows that denote the direction.
             d = [w * np.cos(road.angle), w * -np.sin(road.angle)]
@@ -295,12 +499,19 @@ class Simulation:
             # Draw the traffic light color onto the road.
             # The arrow points in the direction of the road.
             trafficlight_color = GREEN if road.green else RED
-            pygame.draw.line(screen, trafficlight_color, p1s, center, width=5)
-            pygame.draw.line(screen, trafficlight_color, p2s, center, width=5)
+            center = self.to_screen(center)
+            for p in [p1s, p2s]:
+                pygame.draw.line(
+                    screen, trafficlight_color, self.to_screen(p), center, width=5
+                )
 
     def draw_cars(self):
-        """Draw the cars to the screen."""
-        for car in self.cars:
+        """Draw the cars to the screen, also the cars in queues."""
+        queued = []
+        for queue in self.meso.values():
+            queue.update(self.timer)
+            queued.extend(queue.cars())
+        for car in self.cars + queued:
 
             # Get the perpendicular angle for the width of the car.
             perp = (car.dir + np.pi / 2) % (np.pi * 2)
@@ -318,22 +529,52 @@ class Simulation:
             p4 = [x - y + z for x, y, z in zip(car.pos, offsetw, offsetl)]
 
             # Draw the car.
-            pygame.draw.polygon(screen, car.color, [p1, p2, p3, p4])
+            corners = [self.to_screen(p) for p in [p1, p2, p3, p4]]
+            pygame.draw.polygon(screen, car.color, corners)
 
     def draw_pol_map(self):
         """Draws the map of the different types of pollution."""
 
+        self.flush_pollution()
+
         _, axs = plt.subplots(2, 2, figsize=(8, 8))
         plt.suptitle("Pollution heatmap for differnet pollution types")
         plt.subplots_adjust(wspace=0.02, hspace=0.1)
         for pol_map, ax in zip(self.pol_maps, axs.flatten()):
             # ax.set_aspect('equal')
-            pol_map.draw_map(ax, self.pol_spread)
+            # Draw the world and the pollution spread around it.
+            pol_map.draw_map(
+                ax,
+                self.pol_spread,
+                (
+                    self.world[0] - self.pol_spread,
+                    self.world[1] - self.pol_spread,
+                    self.world[2] + self.pol_spread,
+                    self.world[3] + self.pol_spread,
+                ),
+            )
         plt.savefig("pollution.png")
 
+    def save_pol_maps(self, filename):
+        """
+        Save the pollution maps as a .npz file with the tiles of the grid of
+        every type of pollution, which can be processed with postprocess.py.
+        The tile coordinates are saved as <type>_keys and the tiles as
+        <type>_tiles (see TiledGrid.to_tiles), and the size of the cells as
+        cell_size.
+        """
+        self.flush_pollution()
+        grids = {}
+        for pol_map in self.pol_maps:
+            keys, tiles = pol_map.rasterise().to_tiles()
+            grids[pol_map.pol_type + "_keys"] = keys
+            grids[pol_map.pol_type + "_tiles"] = tiles
+        np.savez(filename, cell_size=self.cell_size, **grids)
+
 
 def main():
-    sim = Simulation()
+    # Record the simulation if a file is given.
+    sim = Simulation(record=sys.argv[1] if len(sys.argv) > 1 else None)
     # Otherwise the window is immediately closed.
     while True:
         sim.step()
@@ -341,6 +582,8 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 sim.draw_pol_map()
+                if sim.recorder:
+                    sim.recorder.save(sim.FPS)
                 pygame.quit()
                 sys.exit()
 
@@ -0,0 +1,56 @@
+"""
+This file contains the random streams used by a simulation. Every source of
+randomness (arrivals of cars, their routes and their speeds) draws from its
+own stream. Seeding the streams in the same way for different inputs of an
+experiment gives common random numbers, and an antithetic stream uses 1 - u
+for every uniform number u of the normal stream with the same seed.
+"""
+
+import random
+
+# The sources of randomness in a simulation.
+SOURCES = ["arrival", "route", "speed"]
+
+
+class GlobalStream:
+    """
+    A stream that uses the global random generators, for simulations that
+    are not given a seed.
+    """
+
+    def random(self):
+        return random.random()
+
+    def uniform(self, a, b):
+        return random.uniform(a, b)
+
+
+class Stream:
+    """A seeded random stream, which can be antithetic."""
+
+    def __init__(self, seed, antithetic=False) -> None:
+        """Sets the seed of the stream and whether it is antithetic."""
+        self.rng = random.Random(seed)
+        self.antithetic = antithetic
+
+    def random(self):
+        """A uniform number in [0, 1]."""
+        u = self.rng.random()
+        return 1 - u if self.antithetic else u
+
+    def uniform(self, a, b):
+        """A uniform number between a and b."""
+        return a + (b - a) * self.random()
+
+
+def make_streams(seed=None, antithetic=False):
+    """
+    Make a stream for every source of randomness. Without a seed, all
+    sources use the global random generators.
+    """
+    if seed is None:
+        stream = GlobalStream()
+        return {source: stream for source in SOURCES}
+    return {
+        source: Stream(f"{seed}-{source}", antithetic) for source in SOURCES
+    }
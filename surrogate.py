@@ -0,0 +1,246 @@
+"""
+This file contains a surrogate model of the pollution, fitted to the results
+of earlier simulations. experiment.py stores the result of every run in a
+table of the light duration, the car generation probability, the number of
+seconds, the type of pollution and the pollution per car per second. For
+every type of pollution a Gaussian process is fitted to that table, which
+predicts the pollution at any other input with its uncertainty, without
+running a simulation. It also proposes the inputs where new simulations
+would reduce that uncertainty most.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+# The inputs that are proposed for new simulations, which are the ranges of
+# the experiments in experiment.py.
+LIGHT_DURATIONS = np.arange(5, 36)
+CAR_GEN_PROBS = np.arange(2, 33)
+
+# The length scales and noise variances that are tried when fitting, for the
+# normalised inputs and outputs.
+LENGTH_SCALES = [0.2, 0.5, 1, 2, 5]
+NOISES = [1e-3, 1e-2, 0.1, 0.3, 1]
+
+
+def load_runs(filenames, secs=None):
+    """
+    Load the results of the runs from tables with the columns light_duration,
+    car_gen_prob, secs, pollutant and value. Only runs of secs seconds are
+    used, which can be left out if all runs have the same length. Returns
+    the inputs and outputs for every type of pollution.
+    """
+    rows = []
+    for filename in filenames:
+        with open(filename) as file:
+            next(file)
+            for line in file:
+                rows.append(line.strip().split(","))
+
+    lengths = sorted({float(row[2]) for row in rows})
+    if secs is None:
+        if len(lengths) > 1:
+            raise ValueError(
+                f"The runs have different lengths {lengths}, choose one."
+            )
+        secs = lengths[0] if lengths else 0
+
+    runs = {}
+    for light_duration, car_gen_prob, length, pollutant, value in rows:
+        if float(length) != secs:
+            continue
+        runs.setdefault(pollutant, ([], []))
+        runs[pollutant][0].append((float(light_duration), float(car_gen_prob)))
+        runs[pollutant][1].append(float(value))
+    if not runs:
+        raise ValueError(f"There are no runs of {secs} seconds.")
+    return {p: (np.array(x), np.array(y)) for p, (x, y) in runs.items()}
+
+
+class GaussianProcess:
+    """
+    A Gaussian process with a squared exponential kernel, with a length
+    scale for every input and noise for the spread between repetitions.
+    """
+
+    def __init__(self, x, y) -> None:
+        """Fit the process to inputs x of shape (n, d) and outputs y."""
+        # Normalise the inputs and outputs. An input that was not varied
+        # keeps its scale.
+        self.x_mean = x.mean(0)
+        self.x_std = np.where(x.std(0) > 0, x.std(0), 1)
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1
+        self.x = (x - self.x_mean) / self.x_std
+        self.y = (y - self.y_mean) / self.y_std
+
+        # Pick the length scales and noise with the highest likelihood.
+        best = None
+        for lengths in np.array(
+            np.meshgrid(*[LENGTH_SCALES] * x.shape[1])
+        ).reshape(x.shape[1], -1).T:
+            for noise in NOISES:
+                fit = self.fit(lengths, noise)
+                if fit is not None and (best is None or fit[0] > best[0]):
+                    best = fit
+        _, self.lengths, self.noise, self.chol, self.alpha = best
+
+    def kernel(self, a, b, lengths=None):
+        """The covariance between the normalised inputs a and b."""
+        lengths = self.lengths if lengths is None else lengths
+        d = (a[:, None, :] - b[None, :, :]) / lengths
+        return np.exp(-0.5 * (d**2).sum(2))
+
+    def fit(self, lengths, noise):
+        """
+        Returns the log marginal likelihood, the parameters, the Cholesky
+        factor of the covariance of the data and its inverse times the data,
+        or None if the covariance is not positive definite.
+        """
+        k = self.kernel(self.x, self.x, lengths) + noise * np.eye(len(self.x))
+        try:
+            chol = np.linalg.cholesky(k)
+        except np.linalg.LinAlgError:
+            return None
+        alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, self.y))
+        likelihood = (
+            -0.5 * self.y @ alpha
+            - np.log(np.diag(chol)).sum()
+            - 0.5 * len(self.x) * np.log(2 * np.pi)
+        )
+        return likelihood, lengths, noise, chol, alpha
+
+    def normalise(self, x):
+        return (np.atleast_2d(x) - self.x_mean) / self.x_std
+
+    def predict(self, x, noise=False):
+        """
+        The mean and standard deviation of the output at inputs x. Without
+        noise, this is the uncertainty of the expected output. With noise,
+        the spread between repetitions is added.
+        """
+        x = self.normalise(x)
+        k = self.kernel(x, self.x)
+        v = np.linalg.solve(self.chol, k.T)
+        var = np.maximum(1 - (v**2).sum(0), 0)
+        if noise:
+            var += self.noise
+        return (
+            self.y_mean + self.y_std * (k @ self.alpha),
+            self.y_std * np.sqrt(var),
+        )
+
+    def covariance(self, x):
+        """The covariance of the expected output at inputs x, normalised."""
+        x = self.normalise(x)
+        v = np.linalg.solve(self.chol, self.kernel(x, self.x).T)
+        return self.kernel(x, x) - v.T @ v
+
+    def propose(self, candidates, n):
+        """
+        Pick n of the candidate inputs to simulate next. Every pick is the
+        candidate with the most uncertain output, given the runs and the
+        earlier picks. The uncertainty after a run does not depend on its
+        result, so the picks are made one by one without simulating.
+        """
+        cov = self.covariance(candidates)
+        picks = []
+        for _ in range(min(n, len(candidates))):
+            i = int(np.argmax(np.diag(cov)))
+            picks.append(i)
+            cov = cov - np.outer(cov[:, i], cov[i]) / (cov[i, i] + self.noise)
+        return candidates[picks]
+
+
+class Surrogate:
+    """A Gaussian process for every type of pollution in the runs."""
+
+    def __init__(self, filenames, secs=None) -> None:
+        """Fit the models to the runs of secs seconds in the tables."""
+        self.models = {
+            pollutant: GaussianProcess(x, y)
+            for pollutant, (x, y) in load_runs(filenames, secs).items()
+        }
+
+    def model(self, pollutant):
+        """The model of a type of pollution, which must be in the runs."""
+        if pollutant not in self.models:
+            raise ValueError(
+                f"There are no runs of {pollutant}, only of "
+                + ", ".join(sorted(self.models))
+                + "."
+            )
+        return self.models[pollutant]
+
+    def predict(self, light_duration, car_gen_prob, pollutant="CO2"):
+        """
+        The expected pollution per car per second and its standard
+        deviation, for a single input.
+        """
+        mean, std = self.model(pollutant).predict(
+            [light_duration, car_gen_prob]
+        )
+        return mean[0], std[0]
+
+    def propose(self, n, pollutant="CO2", candidates=None):
+        """
+        The n inputs (light duration, car generation probability) where new
+        simulations reduce the uncertainty most.
+        """
+        if candidates is None:
+            candidates = np.array(
+                np.meshgrid(LIGHT_DURATIONS, CAR_GEN_PROBS)
+            ).reshape(2, -1).T
+        return self.model(pollutant).propose(candidates, n)
+
+
+def main():
+    # The tables of runs, followed by "query light_duration car_gen_prob" or
+    # "propose n", and optionally the type of pollution. With --secs, only
+    # the runs of that many seconds are used.
+    args = list(sys.argv)
+    secs = None
+    if "--secs" in args:
+        i = args.index("--secs")
+        secs = float(args[i + 1])
+        del args[i : i + 2]
+
+    for i, arg in enumerate(args):
+        if arg in ("query", "propose") and i > 1:
+            break
+    else:
+        print(
+            "Usage: python3 surrogate.py runs.csv [...] [--secs secs] "
+            "query light_duration car_gen_prob [pollutant] | "
+            "propose n [pollutant]"
+        )
+        return
+    surrogate = Surrogate(args[1:i], secs)
+
+    if arg == "query":
+        pollutant = args[i + 3] if len(args) > i + 3 else "CO2"
+        start = time.perf_counter()
+        mean, std = surrogate.predict(
+            float(args[i + 1]), float(args[i + 2]), pollutant
+        )
+        ms = (time.perf_counter() - start) * 1000
+        print(f"{pollutant}: {mean:.3f} +- {std:.3f} mg per car per second")
+        print(f"Answered in {ms:.2f} ms")
+    else:
+        # An input can be proposed more than once, to repeat it.
+        pollutant = args[i + 2] if len(args) > i + 2 else "CO2"
+        runs = {}
+        for x in surrogate.propose(int(args[i + 1]), pollutant):
+            runs[tuple(x)] = runs.get(tuple(x), 0) + 1
+        for (light_duration, car_gen_prob), n in runs.items():
+            mean, std = surrogate.predict(light_duration, car_gen_prob, pollutant)
+            print(
+                f"light_duration={light_duration} car_gen_prob={car_gen_prob}: "
+                f"{n} run(s), now {mean:.3f} +- {std:.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()